@@ -1,23 +1,65 @@
 import os
+import time
+import uuid
+import hashlib
+import queue
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import Response, jsonify
+from flask import Response, jsonify, redirect, stream_with_context
 import boto3
-import psycopg2
-import threading
 import subprocess
-import shutil
 from urllib.parse import urlparse
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify
 from werkzeug.utils import secure_filename
+from werkzeug.http import http_date
+from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
 from flask_cors import CORS
 import warnings
 from boto3.compat import PythonDeprecationWarning
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from services.job_dispatcher import JobDispatcher
+from services.status_stream import StatusBroadcaster, format_event
+from services.result_cache import ResultCache
+from services.pipeline_version import PIPELINE_VERSION
+from services.job_protocol import (
+    JOB_NOTIFY_CHANNEL, JOB_STATUS_CHANNEL, IDEMPOTENCY_KEY_TTL, CONTENT_KEY_PATTERN
+)
+from db.connection_pool import ConnectionPool
 
 # Suppress boto3 deprecation warnings
 warnings.filterwarnings("ignore", category=PythonDeprecationWarning)
 
+# Upload tuning for /upload-images: both images go to S3 concurrently on a
+# shared pool; parts are sent in parallel once a file passes the threshold
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 8))
+UPLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 ** 2,
+    multipart_chunksize=8 * 1024 ** 2,
+    max_concurrency=4,
+    use_threads=True
+)
+# Largest image accepted, by /upload-images and by the presigned POST policies
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 10 * 1024 ** 2))
+# Uploaded files up to this size stay in memory instead of a temp file
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", MAX_UPLOAD_BYTES))
+
+
+class UploadRequest(Request):
+    """Request that buffers uploaded files in memory rather than on disk"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES, mode="rb+")
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
+# Both images plus room for the multipart headers and form fields
+app.config["MAX_CONTENT_LENGTH"] = 2 * MAX_UPLOAD_BYTES + 64 * 1024
 CORS(app)  # Enable CORS for all routes
 load_dotenv()
 
@@ -36,20 +78,140 @@ DB_PARAMS = {
     'port': os.getenv("DB_PORT")
 }
 
+# Shared connection pool used by every route
+db_pool = ConnectionPool(
+    int(os.getenv("DB_POOL_MIN", 1)),
+    int(os.getenv("DB_POOL_MAX", 10)),
+    DB_PARAMS
+)
+
+# Maximum number of job IDs accepted by /status/batch
+MAX_BATCH_STATUS_IDS = int(os.getenv("MAX_BATCH_STATUS_IDS", 100))
+
+# images.id is a PostgreSQL integer (int4)
+MAX_JOB_ID = 2 ** 31 - 1
+
+# Seconds between SSE keep-alive comments on an idle status stream
+STATUS_STREAM_KEEPALIVE = 15
+
 # Local directories
 WORKING_DIR = os.path.dirname(os.path.abspath(__file__))
-TEMP_DIR = r"C:\Users\singh\project\backend\services\temp"
 # Initialize S3 client
 s3_client = boto3.client(
     "s3",
     aws_access_key_id=AWS_ACCESS_KEY_ID,
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
+    region_name=AWS_REGION,
+    # Enough connections for every upload worker's parallel parts
+    config=Config(max_pool_connections=UPLOAD_WORKERS * UPLOAD_TRANSFER_CONFIG.max_concurrency)
 )
 
+# Shared by all requests so concurrent uploads reuse threads and connections
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+
+# Direct-to-S3 uploads: S3 key prefix per image kind and the limits
+# enforced by the presigned POST policy
+UPLOAD_PREFIXES = {"dress": "dress", "person": "person"}
+ALLOWED_UPLOAD_TYPES = ("image/jpeg", "image/png", "image/webp")
+UPLOAD_POLICY_EXPIRES = int(os.getenv("UPLOAD_POLICY_EXPIRES", 600))
+
+# Bytes per chunk when streaming result images from S3
+RESULT_IMAGE_CHUNK_SIZE = 64 * 1024
+
+# How /result-image serves results: "proxy" streams the bytes through Flask,
+# "redirect" answers with a 302 to a short-lived presigned S3 URL
+RESULT_IMAGE_MODE = os.getenv("RESULT_IMAGE_MODE", "proxy")
+PRESIGNED_URL_EXPIRES = int(os.getenv("PRESIGNED_URL_EXPIRES", 300))
+# Stop handing out a cached presigned URL this many seconds before it expires
+PRESIGNED_URL_MARGIN = int(os.getenv("PRESIGNED_URL_MARGIN", 30))
+
+# Completed results cached in memory and on disk; the orchestrator seeds the
+# disk level, so RESULT_CACHE_DIR must match in both processes
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(WORKING_DIR, "services", "result_cache"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 1024 ** 3))
+RESULT_CACHE_MEMORY_BYTES = int(os.getenv("RESULT_CACHE_MEMORY_BYTES", 64 * 1024 ** 2))
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MEMORY_BYTES)
+
+# job_id -> (presigned URL, expiry timestamp)
+presigned_urls = {}
+presigned_urls_lock = threading.Lock()
+
 # Path to the preprocessing orchestrator script
 PREPROCESSOR_SCRIPT = r"C:\Users\singh\project\backend\services\generate_image_service.py"
 
+# Bounded dispatch of orchestrator runs: at most MAX_CONCURRENT_JOBS pipelines
+# at once and JOB_QUEUE_SIZE waiting; anything beyond stays 'pending' in the
+# database for the daemon to claim.
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 2))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 20))
+
+def run_preprocessor(job_id):
+    """Run the preprocessing orchestrator for one job in a separate process"""
+    try:
+        subprocess.run(["python", PREPROCESSOR_SCRIPT, "--job-id", str(job_id)], check=True)
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Preprocessor failed for job {job_id}: {e}")
+    except Exception as e:
+        app.logger.error(f"Error running preprocessor for job {job_id}: {e}")
+
+job_dispatcher = JobDispatcher(run_preprocessor, MAX_CONCURRENT_JOBS, JOB_QUEUE_SIZE)
+
+def s3_url(s3_key):
+    """Public URL of an object in the bucket (if objects are public via bucket policy)"""
+    return f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
+
+def content_hash(image_path, kind):
+    """SHA-256 of an input image if it was uploaded by /upload-images, else None.
+
+    Only URLs in our own bucket are trusted: anywhere else the name says
+    nothing about the bytes behind it.
+    """
+    prefix = s3_url(f"{UPLOAD_PREFIXES[kind]}/")
+    if not image_path.startswith(prefix):
+        return None
+    match = CONTENT_KEY_PATTERN.fullmatch(image_path[len(prefix):])
+    return match.group(1) if match else None
+
+def upload_image_once(image, prefix):
+    """Upload an image under its content hash unless S3 already has it.
+
+    Returns (s3_key, sha256 hex digest).
+    """
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: image.stream.read(1024 * 1024), b''):
+        sha.update(chunk)
+    digest = sha.hexdigest()
+    image.stream.seek(0)
+
+    ext = os.path.splitext(secure_filename(image.filename or ""))[1].lower() or ".jpg"
+    s3_key = f"{prefix}/{digest}{ext}"
+
+    try:
+        s3_client.head_object(Bucket=AWS_S3_BUCKET_NAME, Key=s3_key)
+        app.logger.info(f"{s3_key} already uploaded, skipping")
+        return s3_key, digest
+    except ClientError as e:
+        # Without s3:ListBucket S3 answers 403 rather than 404 for a missing
+        # key; upload anyway, PutObject is all the baseline needed
+        if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') not in (403, 404):
+            raise
+
+    s3_client.upload_fileobj(
+        image.stream, AWS_S3_BUCKET_NAME, s3_key,
+        ExtraArgs={"ContentType": image.mimetype or "image/jpeg"},
+        Config=UPLOAD_TRANSFER_CONFIG
+    )
+    return s3_key, digest
+
+def input_image_path(data, kind):
+    """Image URL for /generate from either <kind>_image_path or an uploaded <kind>_image_key"""
+    s3_key = data.get(f"{kind}_image_key")
+    if s3_key is None:
+        return data.get(f"{kind}_image_path")
+    if not isinstance(s3_key, str) or not s3_key.startswith(f"{UPLOAD_PREFIXES[kind]}/"):
+        raise ValueError(f"{kind}_image_key must be under {UPLOAD_PREFIXES[kind]}/")
+    return s3_url(s3_key)
+
 @app.route('/upload-images', methods=['POST'])
 def upload_images():
     try:
@@ -60,88 +222,211 @@ def upload_images():
         if not dress_image or not person_image:
             return jsonify({"error": "Both images are required"}), 400
 
-        # Secure filenames, using default values if necessary
-        dress_filename = secure_filename(dress_image.filename) if dress_image.filename else "default_dress.jpg"
-        person_filename = secure_filename(person_image.filename) if person_image.filename else "default_person.jpg"
+        # Upload both files to S3 concurrently, without ACL, keyed by content
+        # hash so identical images are stored (and uploaded) only once
+        uploads = [
+            upload_executor.submit(upload_image_once, image, prefix)
+            for image, prefix in ((dress_image, UPLOAD_PREFIXES["dress"]), (person_image, UPLOAD_PREFIXES["person"]))
+        ]
+        (dress_s3_path, dress_hash), (person_s3_path, person_hash) = [upload.result() for upload in uploads]
 
-        if dress_filename == '' or person_filename == '':
-            return jsonify({"error": "Filename after sanitization is empty"}), 400
-
-        # Construct S3 paths
-        dress_s3_path = f'dress/{dress_filename}'
-        person_s3_path = f'person/{person_filename}'
-
-        # Upload files to S3 without ACL
-        s3_client.upload_fileobj(dress_image, AWS_S3_BUCKET_NAME, dress_s3_path)
-        s3_client.upload_fileobj(person_image, AWS_S3_BUCKET_NAME, person_s3_path)
-
-        # Construct the public URLs for the uploaded images (if objects are public via bucket policy)
-        dress_url = f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{dress_s3_path}"
-        person_url = f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{person_s3_path}"
+        # Construct the public URLs for the uploaded images
+        dress_url = s3_url(dress_s3_path)
+        person_url = s3_url(person_s3_path)
 
         return jsonify({
             "message": "Images uploaded successfully",
             "dress_image_url": dress_url,
-            "person_image_url": person_url
+            "person_image_url": person_url,
+            "dress_image_hash": dress_hash,
+            "person_image_hash": person_hash
         }), 200
 
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Images may be at most {MAX_UPLOAD_BYTES} bytes each"}), 413
     except Exception as e:
         app.logger.error("Error in /upload-images: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/generate', methods=['POST'])
-def generate():
+@app.route('/upload-urls', methods=['POST'])
+def create_upload_urls():
+    """Presigned POST policies so clients upload images straight to S3"""
     try:
-        # Get the image URLs from the request
         data = request.json
-        if not data or 'dress_image_path' not in data or 'person_image_path' not in data:
-            return jsonify({"error": "Both dress and person image paths are required"}), 400
-
-        dress_image_path = data['dress_image_path']
-        person_image_path = data['person_image_path']
-
-        # Connect to the database
-        conn = psycopg2.connect(**DB_PARAMS)
-        cursor = conn.cursor()
+        if not isinstance(data, dict) or not any(kind in data for kind in UPLOAD_PREFIXES):
+            return jsonify({"error": "A dress or person image description is required"}), 400
+
+        uploads = {}
+        for kind, prefix in UPLOAD_PREFIXES.items():
+            if kind not in data:
+                continue
+            image = data[kind] or {}
+            if not isinstance(image, dict):
+                return jsonify({"error": f"The {kind} image description must be an object"}), 400
+            content_type = image.get('content_type', 'image/jpeg')
+            if content_type not in ALLOWED_UPLOAD_TYPES:
+                return jsonify({"error": f"Unsupported content type for {kind} image: {content_type}"}), 400
+
+            filename = secure_filename(image.get('filename') or "") or f"default_{kind}.jpg"
+            s3_key = f"{prefix}/{uuid.uuid4().hex}_{filename}"
+
+            # The policy pins the key and content type and caps the size
+            policy = s3_client.generate_presigned_post(
+                AWS_S3_BUCKET_NAME,
+                s3_key,
+                Fields={"Content-Type": content_type},
+                Conditions=[
+                    {"Content-Type": content_type},
+                    ["content-length-range", 1, MAX_UPLOAD_BYTES]
+                ],
+                ExpiresIn=UPLOAD_POLICY_EXPIRES
+            )
+            uploads[kind] = {
+                "url": policy["url"],
+                "fields": policy["fields"],
+                "key": s3_key,
+                "image_url": s3_url(s3_key)
+            }
 
-        # Insert into the images table
-        cursor.execute(
-            """
-            INSERT INTO images (person_image_path, cloth_image_path, status)
-            VALUES (%s, %s, %s)
-            RETURNING id
-            """,
-            (person_image_path, dress_image_path, 'pending')
-        )
-        
-        # Get the ID of the newly inserted row
-        image_id = cursor.fetchone()[0]
-
-        # Insert into the preprocessing_steps table
-        cursor.execute(
-            """
-            INSERT INTO preprocessing_steps (image_id)
-            VALUES (%s)
-            """,
-            (image_id,)
-        )
+        return jsonify({
+            "uploads": uploads,
+            "max_bytes": MAX_UPLOAD_BYTES,
+            "expires_in": UPLOAD_POLICY_EXPIRES
+        }), 200
 
-        # Commit the transaction
-        conn.commit()
-        cursor.close()
-        conn.close()
+    except Exception as e:
+        app.logger.error("Error in /upload-urls: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
 
-        # Start the preprocessing orchestrator in a separate process
-        def run_preprocessor(job_id):
-            try:
-                subprocess.run(["python", PREPROCESSOR_SCRIPT, "--job-id", str(job_id)], check=True)
-            except subprocess.CalledProcessError as e:
-                app.logger.error(f"Preprocessor failed for job {job_id}: {e}")
-            except Exception as e:
-                app.logger.error(f"Error running preprocessor for job {job_id}: {e}")
+@app.route('/generate', methods=['POST'])
+def generate():
+    try:
+        # Get the image URLs (or keys of direct uploads) from the request
+        data = request.json or {}
+        try:
+            dress_image_path = input_image_path(data, "dress")
+            person_image_path = input_image_path(data, "person")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if not dress_image_path or not person_image_path:
+            return jsonify({"error": "Both dress and person image paths are required"}), 400
 
-        # Run the preprocessor in a separate thread
-        threading.Thread(target=run_preprocessor, args=(image_id,)).start()
+        person_hash = content_hash(person_image_path, "person")
+        dress_hash = content_hash(dress_image_path, "dress")
+
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+            return jsonify({"error": "Idempotency-Key must be 1 to 255 characters"}), 400
+
+        # Borrow a pooled database connection
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+
+            # Claim the idempotency key first. A concurrent request with the
+            # same key blocks here until this transaction ends; an expired key
+            # is taken over as if it were new.
+            if idempotency_key:
+                cursor.execute(
+                    """
+                    INSERT INTO idempotency_keys (idempotency_key)
+                    VALUES (%s)
+                    ON CONFLICT (idempotency_key) DO UPDATE
+                    SET image_id = NULL, created_at = CURRENT_TIMESTAMP
+                    WHERE idempotency_keys.created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                    RETURNING idempotency_key
+                    """,
+                    (idempotency_key, IDEMPOTENCY_KEY_TTL)
+                )
+                if not cursor.fetchone():
+                    # Retry of a request that already created a job
+                    cursor.execute(
+                        """
+                        SELECT i.id, i.status FROM idempotency_keys k
+                        JOIN images i ON i.id = k.image_id
+                        WHERE k.idempotency_key = %s
+                        """,
+                        (idempotency_key,)
+                    )
+                    original = cursor.fetchone()
+                    cursor.close()
+                    if not original:
+                        return jsonify({"error": "Idempotency-Key is already in use"}), 409
+                    return jsonify({
+                        "message": "Generation request already submitted",
+                        "job_id": original[0],
+                        "status": original[1],
+                        "idempotent_replay": True
+                    }), 200
+
+            # Same person and garment already rendered by this pipeline version:
+            # hand back that job instead of running the pipeline again
+            if person_hash and dress_hash:
+                cursor.execute(
+                    """
+                    SELECT id, aws_url FROM images
+                    WHERE person_image_hash = %s AND cloth_image_hash = %s
+                      AND pipeline_version = %s AND status = 'completed'
+                    ORDER BY id DESC
+                    LIMIT 1
+                    """,
+                    (person_hash, dress_hash, PIPELINE_VERSION)
+                )
+                existing = cursor.fetchone()
+                if existing:
+                    if idempotency_key:
+                        cursor.execute(
+                            "UPDATE idempotency_keys SET image_id = %s WHERE idempotency_key = %s",
+                            (existing[0], idempotency_key)
+                        )
+                        conn.commit()
+                    cursor.close()
+                    return jsonify({
+                        "message": "Identical request already completed",
+                        "job_id": existing[0],
+                        "status": "completed",
+                        "result_url": existing[1] or f"/result-image/{existing[0]}",
+                        "deduplicated": True
+                    }), 200
+
+            # Insert into the images table
+            cursor.execute(
+                """
+                INSERT INTO images (person_image_path, cloth_image_path, status, person_image_hash, cloth_image_hash)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id
+                """,
+                (person_image_path, dress_image_path, 'pending', person_hash, dress_hash)
+            )
+        
+            # Get the ID of the newly inserted row
+            image_id = cursor.fetchone()[0]
+
+            # Insert into the preprocessing_steps table
+            cursor.execute(
+                """
+                INSERT INTO preprocessing_steps (image_id)
+                VALUES (%s)
+                """,
+                (image_id,)
+            )
+
+            if idempotency_key:
+                cursor.execute(
+                    "UPDATE idempotency_keys SET image_id = %s WHERE idempotency_key = %s",
+                    (image_id, idempotency_key)
+                )
+
+            # Wake idle daemons; the notification is delivered on commit
+            cursor.execute("SELECT pg_notify(%s, %s)", (JOB_NOTIFY_CHANNEL, str(image_id)))
+
+            # Commit the transaction
+            conn.commit()
+            cursor.close()
+
+        # Hand the job to the bounded dispatcher; if it is saturated the job
+        # stays pending and a daemon claims it
+        job_dispatcher.submit(image_id)
 
         # Return success response
         return jsonify({
@@ -151,134 +436,287 @@ def generate():
         }), 200
 
     except Exception as e:
+        # An uncommitted transaction is rolled back when the connection returns to the pool
         app.logger.error("Error in /generate: %s", e, exc_info=True)
-        # If an error occurs, rollback the transaction
-        if 'conn' in locals() and conn:
-            conn.rollback()
         return jsonify({"error": str(e)}), 500
 
+# Status columns shared by the single and batch status endpoints
+STATUS_QUERY = """
+    SELECT
+        i.id,
+        i.status,
+        i.result_image_path,
+        i.aws_url,
+        p.remove_bg_status,
+        p.segmentation_status,
+        p.pose_generation_status,
+        p.cloth_resize_status,
+        p.cloth_mask_status
+    FROM images i
+    LEFT JOIN preprocessing_steps p ON p.image_id = i.id
+"""
+
+def status_response(row):
+    """Build the /status JSON body from a STATUS_QUERY row"""
+    job_id, image_status, result_image_path, aws_url = row[:4]
+    return {
+        "job_id": job_id,
+        "overall_status": image_status,
+        # Until the background upload lands, completed results are served locally
+        "result_url": aws_url or (f"/result-image/{job_id}" if image_status == "completed" else None),
+        "preprocessing": {
+            "remove_bg": row[4],
+            "segmentation": row[5],
+            "pose_generation": row[6],
+            "cloth_resize": row[7],
+            "cloth_mask": row[8]
+        }
+    }
+
+def load_status(job_id):
+    """Current status body of a job, or None if it does not exist"""
+    # Job and preprocessing steps status in one round trip on a pooled connection
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(STATUS_QUERY + " WHERE i.id = %s", (job_id,))
+        result = cursor.fetchone()
+        cursor.close()
+    return status_response(result) if result else None
+
 @app.route('/status/<int:job_id>', methods=['GET'])
 def get_status(job_id):
     try:
-        # Connect to the database
-        conn = psycopg2.connect(**DB_PARAMS)
-        cursor = conn.cursor()
-
-        # Get the status from the images table
-        cursor.execute(
-            """
-            SELECT status, result_image_path, aws_url FROM images WHERE id = %s
-            """,
-            (job_id,)
-        )
-        
-        result = cursor.fetchone()
-        
-        if not result:
+        status = load_status(job_id)
+        if not status:
             return jsonify({"error": "Job not found"}), 404
         
-        image_status, result_image_path, aws_url = result
-            
-        # Get the preprocessing steps status
-        cursor.execute(
-            """
-            SELECT 
-                remove_bg_status, 
-                segmentation_status, 
-                pose_generation_status, 
-                cloth_resize_status, 
-                cloth_mask_status
-            FROM preprocessing_steps 
-            WHERE image_id = %s
-            """,
-            (job_id,)
-        )
-        
-        preprocessing_status = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
-        
-        response = {
-            "job_id": job_id,
-            "overall_status": image_status,
-            "result_url": aws_url if aws_url else None,
-            "preprocessing": {
-                "remove_bg": preprocessing_status[0],
-                "segmentation": preprocessing_status[1],
-                "pose_generation": preprocessing_status[2],
-                "cloth_resize": preprocessing_status[3],
-                "cloth_mask": preprocessing_status[4]
-            }
-        }
-        
-        return jsonify(response), 200
+        return jsonify(status), 200
 
     except Exception as e:
         app.logger.error("Error in /status: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/cleanup', methods=['POST'])
-def cleanup_datasets():
+@app.route('/status/batch', methods=['POST'])
+def get_status_batch():
     try:
-        # Get the job ID from the request
         data = request.json
-        if not data or 'job_id' not in data:
-            return jsonify({"error": "Job ID is required"}), 400
+        if not data or not isinstance(data.get('job_ids'), list):
+            return jsonify({"error": "A list of job_ids is required"}), 400
+
+        # JSON integers only: no floats, booleans or numeric strings, and
+        # nothing the id column could not hold
+        if not all(isinstance(job_id, int) and not isinstance(job_id, bool) and 0 < job_id <= MAX_JOB_ID
+                   for job_id in data['job_ids']):
+            return jsonify({"error": f"Job IDs must be integers between 1 and {MAX_JOB_ID}"}), 400
+        job_ids = list(dict.fromkeys(data['job_ids']))
+
+        if len(job_ids) > MAX_BATCH_STATUS_IDS:
+            return jsonify({"error": f"At most {MAX_BATCH_STATUS_IDS} job IDs per request"}), 400
+
+        # Every requested job in one round trip
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(STATUS_QUERY + " WHERE i.id = ANY(%s)", (job_ids,))
+            rows = cursor.fetchall()
+            cursor.close()
+
+        statuses = {row[0]: status_response(row) for row in rows}
+        return jsonify({
+            "jobs": [statuses[job_id] for job_id in job_ids if job_id in statuses],
+            "not_found": [job_id for job_id in job_ids if job_id not in statuses]
+        }), 200
 
-        job_id = data['job_id']
-        
-        # Path to current dataset directory
-        current_dataset_dir = os.path.join(TEMP_DIR, f"datasets-{job_id}")
-        
-        # Find and remove all older dataset directories
-        for item in os.listdir(TEMP_DIR):
-            item_path = os.path.join(TEMP_DIR, item)
-            # Check if it's a datasets directory and not the current one
-            if item.startswith("datasets-") and os.path.isdir(item_path) and item_path != current_dataset_dir:
-                try:
-                    shutil.rmtree(item_path)
-                    app.logger.info(f"Removed old dataset directory: {item_path}")
-                except Exception as e:
-                    app.logger.error(f"Error removing directory {item_path}: {str(e)}")
-        
-        return jsonify({"message": "Cleanup successful"}), 200
-        
     except Exception as e:
-        app.logger.error("Error in /cleanup: %s", e, exc_info=True)
+        app.logger.error("Error in /status/batch: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
-    
 
+status_broadcaster = StatusBroadcaster(DB_PARAMS, JOB_STATUS_CHANNEL, load_status)
+
+@app.route('/status/<int:job_id>/stream', methods=['GET'])
+def stream_status(job_id):
+    """Server-Sent Events stream of a job's status until it completes or fails"""
+    try:
+        # Subscribe before reading the current status so no change is missed
+        updates = status_broadcaster.subscribe(job_id)
+    except Exception as e:
+        app.logger.error("Error in /status stream: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+    try:
+        status = load_status(job_id)
+    except Exception as e:
+        status_broadcaster.unsubscribe(job_id, updates)
+        app.logger.error("Error in /status stream: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
 
+    if not status:
+        status_broadcaster.unsubscribe(job_id, updates)
+        return jsonify({"error": "Job not found"}), 404
+
+    def events(status):
+        try:
+            while True:
+                yield format_event(status, "status")
+                if status["overall_status"] in ("completed", "failed"):
+                    return
+                while True:
+                    try:
+                        status = updates.get(timeout=STATUS_STREAM_KEEPALIVE)
+                        break
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+                if status is None:
+                    # The job was deleted while being watched. Not "error",
+                    # which EventSource reserves for connection failures
+                    yield format_event({"error": "Job not found"}, "not_found")
+                    return
+        finally:
+            status_broadcaster.unsubscribe(job_id, updates)
+
+    return Response(
+        stream_with_context(events(status)),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/dispatcher/stats', methods=['GET'])
+def dispatcher_stats():
+    return jsonify(job_dispatcher.stats()), 200
+
+@app.route('/result-cache/stats', methods=['GET'])
+def result_cache_stats():
+    return jsonify(result_cache.stats()), 200
+
+def presigned_result_url(job_id, s3_key):
+    """Presigned GET URL for a result, reused until shortly before it expires"""
+    now = time.time()
+    with presigned_urls_lock:
+        cached = presigned_urls.get(job_id)
+        if cached and cached[1] - PRESIGNED_URL_MARGIN > now:
+            return cached[0]
+
+    url = s3_client.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": AWS_S3_BUCKET_NAME,
+            "Key": s3_key,
+            "ResponseContentType": "image/jpeg",
+            "ResponseContentDisposition": f"inline; filename=result_{job_id}.jpg"
+        },
+        ExpiresIn=PRESIGNED_URL_EXPIRES
+    )
+    with presigned_urls_lock:
+        # Drop expired URLs so the cache does not grow without bound
+        for expired in [k for k, (_, expires_at) in presigned_urls.items() if expires_at <= now]:
+            del presigned_urls[expired]
+        presigned_urls[job_id] = (url, now + PRESIGNED_URL_EXPIRES)
+    return url
+
+def cached_result_response(job_id, cached):
+    """Serve (bytes, etag) from the result cache, honoring If-None-Match and Range"""
+    data, etag = cached
+    response = Response(
+        data,
+        mimetype='image/jpeg',
+        headers={"Content-Disposition": f"inline; filename=result_{job_id}.jpg"}
+    )
+    response.set_etag(etag.strip('"'))
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
 
 @app.route('/result-image/<int:job_id>', methods=['GET'])
 def get_result_image(job_id):
     try:
-        # Connect to database to get the S3 key
-        conn = psycopg2.connect(**DB_PARAMS)
-        cursor = conn.cursor()
-        cursor.execute("SELECT aws_url FROM images WHERE id = %s", (job_id,))
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        # Results are immutable, so a cached presigned URL skips the database too
+        if RESULT_IMAGE_MODE == "redirect":
+            with presigned_urls_lock:
+                cached = presigned_urls.get(job_id)
+            if cached and cached[1] - PRESIGNED_URL_MARGIN > time.time():
+                return redirect(cached[0], 302)
+
+        # Completed results never change: serve cached bytes without DB or S3
+        if RESULT_IMAGE_MODE != "redirect":
+            cached = result_cache.get(job_id)
+            if cached:
+                return cached_result_response(job_id, cached)
+
+        # Get the S3 key from the database
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT aws_url, result_image_path, status FROM images WHERE id = %s", (job_id,))
+            result = cursor.fetchone()
+            cursor.close()
         
-        if not result or not result[0]:
+        if not result or result[2] != 'completed':
             return jsonify({"error": "Image not found"}), 404
-        
+
+        aws_url, result_image_path = result[:2]
+        if not aws_url:
+            # Completed while the S3 upload is still running: serve the local copy
+            cached = result_cache.get(job_id)
+            if not cached and result_image_path and os.path.exists(result_image_path):
+                result_cache.put_file(job_id, result_image_path)
+                cached = result_cache.get(job_id)
+            if not cached:
+                return jsonify({"error": "Image not found"}), 404
+            return cached_result_response(job_id, cached)
        
-        parsed_url = urlparse(result[0])
+        parsed_url = urlparse(aws_url)
         s3_key = parsed_url.path.lstrip('/') 
         print(s3_key)
-        
-        # Get the object from S3
-        response = s3_client.get_object(Bucket=AWS_S3_BUCKET_NAME, Key=s3_key)
-        image_data = response['Body'].read()
-        
-        # Return the image
+
+        # Let the client fetch the bytes straight from S3
+        if RESULT_IMAGE_MODE == "redirect":
+            return redirect(presigned_result_url(job_id, s3_key), 302)
+
+        # Let S3 evaluate conditional and range requests
+        s3_params = {"Bucket": AWS_S3_BUCKET_NAME, "Key": s3_key}
+        if request.headers.get('If-None-Match'):
+            s3_params["IfNoneMatch"] = request.headers['If-None-Match']
+        if request.headers.get('Range'):
+            s3_params["Range"] = request.headers['Range']
+
+        try:
+            response = s3_client.get_object(**s3_params)
+        except ClientError as e:
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            if status == 304:
+                headers = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+                return Response(status=304, headers={"ETag": headers.get('etag', request.headers['If-None-Match'])})
+            if status == 416:
+                return jsonify({"error": "Requested range not satisfiable"}), 416
+            raise
+
+        headers = {
+            "Content-Disposition": f"inline; filename=result_{job_id}.jpg",
+            "Content-Length": str(response['ContentLength']),
+            "Accept-Ranges": "bytes"
+        }
+        if response.get('ETag'):
+            headers["ETag"] = response['ETag']
+        if response.get('LastModified'):
+            headers["Last-Modified"] = http_date(response['LastModified'])
+        if response.get('ContentRange'):
+            headers["Content-Range"] = response['ContentRange']
+
+        def body_chunks():
+            # Relay the S3 body without holding the whole image in memory
+            try:
+                for chunk in response['Body'].iter_chunks(RESULT_IMAGE_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                response['Body'].close()
+
+        # Keep a copy of complete bodies for the next request
+        chunks = body_chunks()
+        if not response.get('ContentRange'):
+            chunks = result_cache.tee(job_id, chunks)
+
         return Response(
-            image_data,
+            chunks,
+            status=206 if response.get('ContentRange') else 200,
             mimetype='image/jpeg',
-            headers={"Content-Disposition": f"inline; filename=result_{job_id}.jpg"}
+            headers=headers,
+            direct_passthrough=True
         )
     except Exception as e:
         app.logger.error(f"Error retrieving image: {str(e)}")
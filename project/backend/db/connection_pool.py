@@ -0,0 +1,104 @@
+import time
+import weakref
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+
+logger = logging.getLogger("db_pool")
+
+
+class ConnectionPool:
+    """Thread-safe PostgreSQL connection pool with health checks.
+
+    Wraps psycopg2's ThreadedConnectionPool so that callers block (up to
+    timeout seconds) instead of failing when all maxconn connections are in
+    use. Connections are checked on checkout: broken ones, and idle ones that
+    fail a ping, are discarded until a healthy or fresh one turns up. The
+    first connections are only opened on first use, so processes start even
+    while the database is down.
+    """
+
+    def __init__(self, minconn, maxconn, db_params, health_check_interval=30, timeout=30):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.db_params = db_params
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(maxconn)
+        # Keyed by the connection itself, so an entry goes away with its
+        # connection and a new connection can never inherit a timestamp
+        self.last_used = weakref.WeakKeyDictionary()
+
+    def _pool(self):
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self.db_params)
+            return self.pool
+
+    def _healthy(self, conn):
+        if conn.closed or conn.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - self.last_used.get(conn, 0) < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check out a healthy connection, reconnecting if needed"""
+        if not self.slots.acquire(timeout=self.timeout):
+            raise pool.PoolError(f"No database connection available after {self.timeout} seconds")
+        try:
+            connections = self._pool()
+            # After a database restart every idle connection is dead; at most
+            # maxconn of them are pooled, after that getconn opens a new one
+            for _ in range(self.maxconn + 1):
+                conn = connections.getconn()
+                if self._healthy(conn):
+                    return conn
+                logger.warning("Discarding broken database connection, reconnecting")
+                self.last_used.pop(conn, None)
+                connections.putconn(conn, close=True)
+            raise pool.PoolError("Could not get a healthy database connection")
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn):
+        """Return a connection, rolling back anything left uncommitted"""
+        try:
+            if not conn.closed and conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        try:
+            if conn.closed:
+                self.last_used.pop(conn, None)
+            else:
+                self.last_used[conn] = time.monotonic()
+            self.pool.putconn(conn, close=conn.closed != 0)
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        if self.pool is not None:
+            self.pool.closeall()
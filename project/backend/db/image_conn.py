@@ -26,7 +26,8 @@ def create_tables():
         if not images_table_exists:
             create_images_table(cursor)
         else:
-            print("Table 'images' already exists.")
+            print("Table 'images' already exists.  Attempting to alter it.")
+            alter_images_table(cursor)
 
         if not preprocessing_steps_table_exists:
             create_preprocessing_steps_table(cursor)
@@ -34,6 +35,9 @@ def create_tables():
             print("Table 'preprocessing_steps' already exists.  Attempting to alter it.")
             alter_preprocessing_steps_table(cursor)  # Add this function
 
+        create_idempotency_keys_table(cursor)
+        create_indexes(cursor)
+
         # Close the cursor and connection
         cursor.close()
         conn.close()
@@ -58,12 +62,33 @@ def create_images_table(cursor):
         status VARCHAR(10) CHECK (status IN ('pending', 'processing', 'completed', 'failed')) DEFAULT 'pending',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         result_image_path VARCHAR(255),
-        aws_url VARCHAR(255)
+        aws_url VARCHAR(255),
+        lease_owner VARCHAR(255),
+        lease_expires_at TIMESTAMP,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        person_image_hash VARCHAR(64),
+        cloth_image_hash VARCHAR(64),
+        pipeline_version VARCHAR(64),
+        result_upload_started_at TIMESTAMP
     );
     """
     cursor.execute(create_images_sql)
     print("Table 'images' created.")
 
+def alter_images_table(cursor):
+    alter_sql = """
+    ALTER TABLE images
+    ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS person_image_hash VARCHAR(64),
+    ADD COLUMN IF NOT EXISTS cloth_image_hash VARCHAR(64),
+    ADD COLUMN IF NOT EXISTS pipeline_version VARCHAR(64),
+    ADD COLUMN IF NOT EXISTS result_upload_started_at TIMESTAMP;
+    """
+    cursor.execute(alter_sql)
+    print("Table 'images' altered: columns added.")
+
 def create_preprocessing_steps_table(cursor):
     create_preprocessing_steps_sql = """
     CREATE TABLE IF NOT EXISTS preprocessing_steps (
@@ -81,6 +106,11 @@ def create_preprocessing_steps_table(cursor):
         cloth_mask_timestamp TIMESTAMP,
         final_processing_status VARCHAR(10) CHECK (final_processing_status IN ('pending', 'processing', 'completed', 'failed')) DEFAULT 'pending',
         final_processing_timestamp TIMESTAMP,
+        remove_bg_output TEXT,
+        cloth_mask_output TEXT,
+        segmentation_output TEXT,
+        pose_generation_output TEXT,
+        final_processing_output TEXT,
         FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE
     );
     """
@@ -91,10 +121,41 @@ def alter_preprocessing_steps_table(cursor):
     alter_sql = """
     ALTER TABLE preprocessing_steps
     ADD COLUMN IF NOT EXISTS final_processing_status VARCHAR(10) CHECK (final_processing_status IN ('pending', 'processing', 'completed', 'failed')) DEFAULT 'pending',
-    ADD COLUMN IF NOT EXISTS final_processing_timestamp TIMESTAMP;
+    ADD COLUMN IF NOT EXISTS final_processing_timestamp TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS remove_bg_output TEXT,
+    ADD COLUMN IF NOT EXISTS cloth_mask_output TEXT,
+    ADD COLUMN IF NOT EXISTS segmentation_output TEXT,
+    ADD COLUMN IF NOT EXISTS pose_generation_output TEXT,
+    ADD COLUMN IF NOT EXISTS final_processing_output TEXT;
     """
     cursor.execute(alter_sql)
     print("Table 'preprocessing_steps' altered: columns added.")
 
+def create_idempotency_keys_table(cursor):
+    create_idempotency_keys_sql = """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        idempotency_key VARCHAR(255) PRIMARY KEY,
+        image_id INTEGER,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE
+    );
+    """
+    cursor.execute(create_idempotency_keys_sql)
+    print("Table 'idempotency_keys' created.")
+
+def create_indexes(cursor):
+    index_sql = """
+    CREATE UNIQUE INDEX IF NOT EXISTS preprocessing_steps_image_id_idx
+        ON preprocessing_steps (image_id);
+    CREATE INDEX IF NOT EXISTS images_pending_created_at_idx
+        ON images (created_at) WHERE status = 'pending';
+    CREATE INDEX IF NOT EXISTS images_processing_lease_idx
+        ON images (lease_expires_at) WHERE status = 'processing';
+    CREATE INDEX IF NOT EXISTS images_completed_pair_idx
+        ON images (person_image_hash, cloth_image_hash, pipeline_version) WHERE status = 'completed';
+    """
+    cursor.execute(index_sql)
+    print("Indexes on 'images' and 'preprocessing_steps' created.")
+
 if __name__ == "__main__":
     create_tables()
\ No newline at end of file
@@ -0,0 +1,185 @@
+"""Content-addressed on-disk cache for preprocessing artifacts.
+
+Entries are keyed by the SHA-256 of a stage's input bytes plus the stage
+version, so the same person photo or garment is only processed once. Each
+entry is a directory holding the stage's named output files:
+
+    <root>/<stage>/<key[:2]>/<key>/<name><ext>
+
+The cache is bounded by total size; the least recently used entries (by
+directory mtime, refreshed on every hit) are evicted first. The total is
+tracked as entries are added, and the tree is only scanned when it goes
+over the limit (or on the first put). Other processes sharing the
+directory are picked up by that scan.
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger("artifact_cache")
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file's contents"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ArtifactCache:
+    """Size-bounded LRU cache of stage outputs with hit/miss counters"""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        # Bytes in the cache as of the last scan plus what was added since;
+        # None until the first scan
+        self.total = None
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_key(version, *digests):
+        """Combine a stage version and input digests into a cache key"""
+        return hashlib.sha256("|".join((version,) + digests).encode()).hexdigest()
+
+    def entry_dir(self, stage, key):
+        return os.path.join(self.root, stage, key[:2], key)
+
+    def _count(self, counter, stage):
+        with self.lock:
+            counter[stage] = counter.get(stage, 0) + 1
+
+    def get(self, stage, key, outputs):
+        """Copy a cached entry to the paths in outputs ({name: path}).
+
+        Returns True on a hit. A miss (or an incomplete entry) leaves the
+        destination paths untouched.
+        """
+        entry = self.entry_dir(stage, key)
+        try:
+            cached = {f: os.path.join(entry, f) for f in os.listdir(entry)}
+        except OSError:
+            self._count(self.misses, stage)
+            return False
+
+        sources = {}
+        for name, dest in outputs.items():
+            filename = name + os.path.splitext(dest)[1]
+            if filename not in cached:
+                self._count(self.misses, stage)
+                return False
+            sources[name] = cached[filename]
+
+        try:
+            for name, dest in outputs.items():
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copyfile(sources[name], dest)
+            os.utime(entry)
+        except OSError as e:
+            logger.warning(f"Could not restore cached {stage} entry {key}: {str(e)}")
+            self._count(self.misses, stage)
+            return False
+
+        self._count(self.hits, stage)
+        return True
+
+    def put(self, stage, key, outputs):
+        """Store the files in outputs ({name: path}) under key.
+
+        Returns True once the entry exists. Evicts when the tracked total
+        goes over max_bytes.
+        """
+        entry = self.entry_dir(stage, key)
+        staging = f"{entry}.tmp-{uuid.uuid4().hex[:8]}"
+        added = 0
+        try:
+            os.makedirs(staging)
+            for name, src in outputs.items():
+                dest = os.path.join(staging, name + os.path.splitext(src)[1])
+                shutil.copyfile(src, dest)
+                added += os.path.getsize(dest)
+            if os.path.isdir(entry):
+                # Another job filled the same entry first
+                shutil.rmtree(staging, ignore_errors=True)
+                added = 0
+            else:
+                os.replace(staging, entry)
+        except OSError as e:
+            logger.warning(f"Could not cache {stage} entry {key}: {str(e)}")
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+
+        with self.lock:
+            if self.total is not None:
+                self.total += added
+            over = self.total is None or self.total > self.max_bytes
+        if over:
+            self.evict()
+        return True
+
+    def discard(self, stage, key):
+        """Remove one entry, e.g. after its restored files failed validation"""
+        entry = self.entry_dir(stage, key)
+        try:
+            size = sum(e.stat().st_size for e in os.scandir(entry) if e.is_file())
+        except OSError:
+            return
+        shutil.rmtree(entry, ignore_errors=True)
+        with self.lock:
+            if self.total is not None:
+                self.total = max(0, self.total - size)
+
+    def entries(self):
+        """List (mtime, size, path) for every cache entry"""
+        result = []
+        for stage in os.listdir(self.root):
+            stage_dir = os.path.join(self.root, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for prefix in os.listdir(stage_dir):
+                prefix_dir = os.path.join(stage_dir, prefix)
+                for key in os.listdir(prefix_dir):
+                    entry = os.path.join(prefix_dir, key)
+                    if ".tmp-" in key or not os.path.isdir(entry):
+                        continue
+                    try:
+                        size = sum(e.stat().st_size for e in os.scandir(entry) if e.is_file())
+                        result.append((os.path.getmtime(entry), size, entry))
+                    except OSError:
+                        continue
+        return result
+
+    def evict(self):
+        """Scan the cache and remove least recently used entries until it fits max_bytes"""
+        try:
+            entries = sorted(self.entries())
+        except OSError as e:
+            logger.warning(f"Could not scan artifact cache: {str(e)}")
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted cache entry {entry}")
+        with self.lock:
+            self.total = total
+
+    def stats(self):
+        """Hit/miss counters per stage"""
+        with self.lock:
+            stages = set(self.hits) | set(self.misses)
+            return {
+                stage: {"hits": self.hits.get(stage, 0), "misses": self.misses.get(stage, 0)}
+                for stage in sorted(stages)
+            }
@@ -4,20 +4,38 @@ import os
 import sys
 import json
 import argparse
+import select
+import socket
 import subprocess
 import logging
 import boto3
 from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 import psycopg2
 import urllib.request
 import time
 import uuid
 import shutil
 import io
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from urllib.parse import urlparse, unquote
 from datetime import datetime
 from dotenv import load_dotenv
 import warnings
 from PIL import Image
+from model_worker import request_worker, WorkerUnavailable
+from artifact_cache import ArtifactCache, file_digest
+from result_cache import ResultCache
+from job_scratch import JobScratch, ScratchQuotaExceeded, remove_stale
+from pipeline_version import STAGE_DEPENDENCIES, PIPELINE_VERSION, stage_version
+from job_protocol import JOB_NOTIFY_CHANNEL, JOB_STATUS_CHANNEL, IDEMPOTENCY_KEY_TTL, CONTENT_KEY_PATTERN
+
+# Shared modules under backend/ (this script runs from backend/services)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db.connection_pool import ConnectionPool
 
 # Suppress warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -41,11 +59,25 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_KEY")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET")
 AWS_S3_BUCKET_NAME = os.getenv("AWS_BUCKET")
 AWS_REGION = os.getenv("AWS_REGION")
+# Input downloads share one pool; each may fetch parts in parallel
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 4))
+S3_TRANSFER_CONFIG = TransferConfig(max_concurrency=4)
 S3_CONFIG = Config(
     connect_timeout=5,
     read_timeout=5,
-    retries={'max_attempts': 3}
+    retries={'max_attempts': 3},
+    max_pool_connections=DOWNLOAD_WORKERS * S3_TRANSFER_CONFIG.max_concurrency
 )
+# S3 retries back off exponentially with full jitter
+DOWNLOAD_RETRIES = 3
+RESULT_UPLOAD_RETRIES = 5
+BACKOFF_BASE = 1
+BACKOFF_MAX = 20
+# Results are uploaded in the background after the job is marked completed
+RESULT_UPLOAD_WORKERS = int(os.getenv("RESULT_UPLOAD_WORKERS", 2))
+# A result upload claimed longer ago than this is taken to have died with
+# its process and may be resumed by another one
+RESULT_UPLOAD_STALE_SECONDS = int(os.getenv("RESULT_UPLOAD_STALE_SECONDS", 15 * 60))
 
 # Database configuration
 DB_PARAMS = {
@@ -56,10 +88,45 @@ DB_PARAMS = {
     'port': os.getenv("DB_PORT")
 }
 
+# Job leases: a claimed job is owned by this worker until lease_expires_at.
+# The lease is renewed every LEASE_HEARTBEAT_SECONDS while the job runs; jobs
+# whose lease ran out (worker died) are requeued, or failed after MAX_ATTEMPTS.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 120))
+LEASE_HEARTBEAT_SECONDS = max(1, LEASE_SECONDS // 4)
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+
+# The daemon purges Idempotency-Keys older than IDEMPOTENCY_KEY_TTL every
+# IDEMPOTENCY_PURGE_SECONDS
+IDEMPOTENCY_PURGE_SECONDS = int(os.getenv("IDEMPOTENCY_PURGE_SECONDS", 60 * 60))
+
+# preprocessing_steps columns driven by the pipeline
+PIPELINE_STEPS = ["remove_bg", "cloth_mask", "segmentation", "pose_generation", "final_processing"]
+
 # Directory setup
 WORKING_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMP_DIR = os.path.join(WORKING_DIR, "temp")
 PROCESSED_DIR = os.path.join(WORKING_DIR, "processed")
+# Final try-on results promoted out of the job scratch directories
+RESULTS_DIR = os.path.join(PROCESSED_DIR, "results")
+# Per-job scratch space for downloads and intermediate files, torn down when
+# the job ends. Point SCRATCH_ROOT at a tmpfs mount to keep them off disk.
+SCRATCH_ROOT = os.getenv("SCRATCH_ROOT", "/dev/shm/virtual-dressing-room" if os.path.isdir("/dev/shm")
+                         else os.path.join(TEMP_DIR, "scratch"))
+SCRATCH_QUOTA_BYTES = int(os.getenv("SCRATCH_QUOTA_BYTES", 512 * 1024 ** 2))
+# Scratch directories older than this belong to processes that died mid-job
+SCRATCH_STALE_SECONDS = int(os.getenv("SCRATCH_STALE_SECONDS", 6 * 60 * 60))
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", os.path.join(WORKING_DIR, "cache"))
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+# Result image cache shared with the Flask app, seeded on job completion
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(WORKING_DIR, "result_cache"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 1024 ** 3))
+# Keep downloaded content-addressed inputs in the artifact cache
+INPUT_CACHE = os.getenv("INPUT_CACHE", "0") == "1"
+# Stages also save their image outputs decoded, as <name>.npy next to the
+# image; later stages and VITON-HD memory-map those instead of decoding
+# (lossy JPEG) files again
+INTERMEDIATE_NPY = os.getenv("INTERMEDIATE_NPY", "0") == "1"
 
 # S3 folder structure
 S3_FOLDERS = {
@@ -72,6 +139,16 @@ S3_FOLDERS = {
     "results": "results"
 }
 
+# Warm model workers (services/model_worker.py), one per conda environment.
+# Stages whose config has a worker_port are sent to the worker first and only
+# fall back to a fresh subprocess when the worker is not reachable.
+MODEL_WORKER_HOST = os.getenv("MODEL_WORKER_HOST", "127.0.0.1")
+USE_MODEL_WORKERS = os.getenv("USE_MODEL_WORKERS", "true").lower() == "true"
+# A worker that timed out is bypassed for this long while it restarts itself
+WORKER_UNHEALTHY_SECONDS = int(os.getenv("WORKER_UNHEALTHY_SECONDS", 300))
+# Worker address -> time (epoch seconds) it may be used again
+unhealthy_workers = {}
+
 # Environment configurations
 ENV_CONFIGS = {
     "remove_bg": {
@@ -79,21 +156,24 @@ ENV_CONFIGS = {
         "name": "tf115",
         "script_path": r"C:\Users\singh\project\ml\preprocessing\remove_bg\removebg.py",
         "python_path": r"C:\Users\singh\anaconda3\envs\tf115\python.exe",
-        "timeout": 300
+        "timeout": 300,
+        "worker_port": 6101
     },
     "cloth_mask": {
         "type": "conda",
         "name": "tf115",
         "script_path": r"C:\Users\singh\project\ml\preprocessing\remove_bg\cloth_mask.py",
         "python_path": r"C:\Users\singh\anaconda3\envs\tf115\python.exe",
-        "timeout": 300
+        "timeout": 300,
+        "worker_port": 6101
     },
     "inf_pgn": {
         "type": "conda",
         "name": "tf115",
         "script_path": r"C:\Users\singh\project\ml\preprocessing\segmentation\CIHP_PGN\inf_pgn.py",
         "python_path": r"C:\Users\singh\anaconda3\envs\tf115\python.exe",
-        "timeout": 600
+        "timeout": 600,
+        "worker_port": 6101
     },
     "openpose": {
         "type": "conda",
@@ -101,7 +181,8 @@ ENV_CONFIGS = {
         "script_path": r"C:\Users\singh\project\ml\preprocessing\openpose\python\10_generate_pose.py",
         "python_path": r"C:\Users\singh\anaconda3\envs\openpose\python.exe",
         "openpose_dir": r"C:\Users\singh\project\ml\preprocessing\openpose",
-        "timeout": 900
+        "timeout": 900,
+        "worker_port": 6102
     },
     "virtual_try_on": {
         "type": "conda",
@@ -109,15 +190,56 @@ ENV_CONFIGS = {
         "script_path": r"C:\Users\singh\project\ml\inferrence\VITON-HD\test.py",
         "python_path": r"C:\Users\singh\anaconda3\envs\schp\python.exe",
         "default_args": ["--name", "viton-hd"],
-        "timeout": 1800
+        "timeout": 1800,
+        "worker_port": 6103
     }
 }
 
+# Independent stages of process_job (see STAGE_DEPENDENCIES) run side by side
+MAX_STAGE_WORKERS = int(os.getenv("MAX_STAGE_WORKERS", 3))
+
+# Per-stage retry policy: extra attempts after a failure and the delay (s) between them.
+# Override per stage with STAGE_RETRIES_<STEP> / STAGE_RETRY_DELAY_<STEP>,
+# e.g. STAGE_RETRIES_POSE_GENERATION=2
+STAGE_RETRY_DEFAULTS = {
+    "remove_bg": {"retries": 1, "delay": 5},
+    "cloth_mask": {"retries": 1, "delay": 5},
+    "segmentation": {"retries": 1, "delay": 10},
+    "pose_generation": {"retries": 1, "delay": 10},
+    "final_processing": {"retries": 0, "delay": 0}
+}
+STAGE_RETRY_POLICIES = {
+    step: {
+        "retries": int(os.getenv(f"STAGE_RETRIES_{step.upper()}", policy["retries"])),
+        "delay": float(os.getenv(f"STAGE_RETRY_DELAY_{step.upper()}", policy["delay"]))
+    }
+    for step, policy in STAGE_RETRY_DEFAULTS.items()
+}
+
+# Serializes use of a job's DB connection between concurrently running stages
+db_lock = threading.Lock()
+
+# Jobs whose lease this worker lost (reaped and possibly claimed elsewhere)
+lost_leases = set()
+# Jobs this worker finished (completed or failed), whose lease it gave up
+released_leases = set()
+
 # Create directories
 os.makedirs(TEMP_DIR, exist_ok=True)
-os.makedirs(PROCESSED_DIR, exist_ok=True)
-for subdir in ["cloth", "image", "image-parse", "openpose-img", "openpose-json", "cloth-mask", "try_on_results"]:
-    os.makedirs(os.path.join(PROCESSED_DIR, subdir), exist_ok=True)
+os.makedirs(RESULTS_DIR, exist_ok=True)
+
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES)
+download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="s3-download")
+# Worker threads are joined at exit, so a --job-id run waits for its upload
+result_upload_executor = ThreadPoolExecutor(max_workers=RESULT_UPLOAD_WORKERS, thread_name_prefix="result-upload")
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+
+# Connections for jobs, lease heartbeats and claims (LISTEN uses its own)
+db_pool = ConnectionPool(
+    int(os.getenv("DB_POOL_MIN", 1)),
+    int(os.getenv("DB_POOL_MAX", 5)),
+    DB_PARAMS
+)
 
 # Initialize S3 client
 s3_client = boto3.client(
@@ -128,19 +250,26 @@ s3_client = boto3.client(
     config=S3_CONFIG
 )
 
-def clean_old_datasets():
-    """Clean up old dataset directories"""
-    try:
-        for item in os.listdir(TEMP_DIR):
-            item_path = os.path.join(TEMP_DIR, item)
-            if item.startswith("datasets-") and os.path.isdir(item_path):
-                shutil.rmtree(item_path)
-                logger.info(f"Removed old dataset: {item}")
-    except Exception as e:
-        logger.error(f"Error cleaning datasets: {str(e)}")
+def parse_s3_url(s3_url):
+    """Split an s3:// or https S3 URL (virtual-hosted or path style) into (bucket, key)"""
+    parsed = urlparse(s3_url)
+    if parsed.scheme == "s3":
+        return parsed.netloc, unquote(parsed.path.lstrip("/"))
+    if parsed.scheme == "https" and parsed.netloc.endswith(".amazonaws.com"):
+        host = parsed.netloc
+        path = unquote(parsed.path.lstrip("/"))
+        if host.startswith("s3.") or host.startswith("s3-"):
+            bucket, _, key = path.partition("/")
+            return bucket, key
+        return host.split(".s3.", 1)[0].split(".s3-", 1)[0], path
+    raise ValueError(f"Invalid S3 URL format: {s3_url}")
 
-def download_with_retry(url, local_path, max_retries=3, delay=5):
-    """Download with retry logic"""
+def backoff_delay(attempt):
+    """Seconds to wait before retry attempt + 1 (exponential, full jitter)"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def download_with_retry(url, local_path, max_retries=DOWNLOAD_RETRIES):
+    """Download with retries, backing off exponentially with jitter"""
     for attempt in range(max_retries):
         try:
             if download_file_from_s3(url, local_path):
@@ -151,27 +280,33 @@ def download_with_retry(url, local_path, max_retries=3, delay=5):
             logger.warning(f"Download attempt {attempt + 1} failed: {str(e)}")
         
         if attempt < max_retries - 1:
-            time.sleep(delay)
+            time.sleep(backoff_delay(attempt))
     
     return False
 
 def download_file_from_s3(s3_url, local_path):
-    """Download file from S3 with retries"""
-    logger.info(f"Downloading {s3_url} to {local_path}")
-    
+    """Download a file from S3, reading through the input cache when enabled.
+
+    Only content-addressed keys in our bucket are cached, and only once the
+    downloaded bytes hash to the digest in the key.
+    """
     try:
-        if s3_url.startswith("https://"):
-            parts = s3_url.replace("https://", "").split(".")
-            bucket = parts[0]
-            key = "/".join(s3_url.split("/")[3:])
-        elif s3_url.startswith("s3://"):
-            parts = s3_url[5:].split("/", 1)
-            bucket = parts[0]
-            key = parts[1] if len(parts) > 1 else ""
-        else:
-            raise ValueError(f"Invalid S3 URL format: {s3_url}")
-        
-        s3_client.download_file(bucket, key, local_path)
+        bucket, key = parse_s3_url(s3_url)
+        match = CONTENT_KEY_PATTERN.fullmatch(key.rsplit("/", 1)[-1]) if bucket == AWS_S3_BUCKET_NAME else None
+        cache_key = match.group(1) if INPUT_CACHE and match else None
+
+        if cache_key and artifact_cache.get("inputs", cache_key, {"image": local_path}):
+            logger.info(f"Using cached copy of {s3_url}")
+            return True
+
+        logger.info(f"Downloading {s3_url} to {local_path}")
+        s3_client.download_file(bucket, key, local_path, Config=S3_TRANSFER_CONFIG)
+
+        if cache_key:
+            if file_digest(local_path) == cache_key:
+                artifact_cache.put("inputs", cache_key, {"image": local_path})
+            else:
+                logger.warning(f"{s3_url} does not match the hash in its key, not caching it")
         return True
     except Exception as e:
         logger.error(f"Failed to download {s3_url}: {str(e)}")
@@ -193,6 +328,26 @@ def upload_file_to_s3(local_path, s3_folder, filename=None):
         logger.error(f"Failed to upload {local_path}: {str(e)}")
         return None
 
+def check_digest(path, expected):
+    """Raise if a downloaded input does not hash to the digest stored for it"""
+    if expected and file_digest(path) != expected:
+        raise Exception(f"{os.path.basename(path)} does not match its stored content hash")
+
+def record_input_hashes(conn, job_id, person_digest, cloth_digest):
+    """Store the digests of a job's downloaded inputs so later identical
+    requests can be deduplicated against it (inputs /generate could not hash)"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE images
+            SET person_image_hash = COALESCE(person_image_hash, %s),
+                cloth_image_hash = COALESCE(cloth_image_hash, %s)
+            WHERE id = %s AND lease_owner = %s
+            """,
+            (person_digest, cloth_digest, job_id, WORKER_ID)
+        )
+    conn.commit()
+
 def validate_image(file_path):
     """Verify an image file is valid"""
     try:
@@ -203,18 +358,48 @@ def validate_image(file_path):
         logger.error(f"Invalid image file {file_path}: {str(e)}")
         return False
 
-def update_db_status(conn, image_id, step, status):
-    """Update processing status in database"""
+def notify_status(cursor, *job_ids):
+    """Queue a status-change notification per job, delivered on commit"""
+    for job_id in job_ids:
+        cursor.execute("SELECT pg_notify(%s, %s)", (JOB_STATUS_CHANNEL, str(job_id)))
+
+def update_db_status(conn, image_id, step, status, outputs=None):
+    """Update processing status in database, with the step's output files if given.
+
+    Only written while this worker holds the job's lease.
+    """
     try:
-        cursor = conn.cursor()
-        
-        # Use the specific status columns from your schema
-        cursor.execute(
-            f"UPDATE preprocessing_steps SET {step}_status = %s, {step}_timestamp = %s WHERE image_id = %s",
-            (status, datetime.now(), image_id)
-        )
-        
-        conn.commit()
+        with db_lock:
+            cursor = conn.cursor()
+            
+            # Use the specific status columns from your schema
+            if outputs is None:
+                cursor.execute(
+                    f"""
+                    UPDATE preprocessing_steps SET {step}_status = %s, {step}_timestamp = %s
+                    FROM images
+                    WHERE preprocessing_steps.image_id = %s AND images.id = preprocessing_steps.image_id
+                      AND images.lease_owner = %s
+                    """,
+                    (status, datetime.now(), image_id, WORKER_ID)
+                )
+            else:
+                cursor.execute(
+                    f"""
+                    UPDATE preprocessing_steps SET {step}_status = %s, {step}_timestamp = %s, {step}_output = %s
+                    FROM images
+                    WHERE preprocessing_steps.image_id = %s AND images.id = preprocessing_steps.image_id
+                      AND images.lease_owner = %s
+                    """,
+                    (status, datetime.now(), json.dumps(outputs), image_id, WORKER_ID)
+                )
+            if cursor.rowcount == 0:
+                conn.rollback()
+                logger.warning(f"Job {image_id} is not leased by this worker, {step} status not recorded")
+                return False
+            notify_status(cursor, image_id)
+            
+            conn.commit()
         return True
     except Exception as e:
         logger.error(f"Database error: {str(e)}")
@@ -244,6 +429,32 @@ def run_in_env(env_config, input_file, output_file, args=None):
     else:
         cmd = [python_path, script_path, "--input", input_file, "--output", output_file] + args
     
+    worker_port = env_config.get("worker_port")
+    address = (MODEL_WORKER_HOST, worker_port)
+    if USE_MODEL_WORKERS and worker_port and unhealthy_workers.get(address, 0) <= time.time():
+        logger.info(f"Sending to {env_config.get('name')} worker at {address}: {' '.join(cmd[1:])}")
+        try:
+            returncode, stdout, stderr = request_worker(address, script_path, cmd[2:], timeout=timeout)
+            if returncode != 0:
+                logger.error(f"Worker command failed. Return code: {returncode}")
+                logger.error(f"Error output: {stderr}")
+                logger.error(f"Standard output: {stdout}")
+                return False
+            logger.debug(f"Command output: {stdout}")
+            if stderr:
+                logger.warning(f"Command stderr: {stderr}")
+            if output_file and not os.path.exists(output_file):
+                logger.error("Worker command did not create the output file")
+                return False
+            return True
+        except TimeoutError:
+            logger.error(f"Worker command timed out after {timeout} seconds, "
+                         f"using subprocesses for {WORKER_UNHEALTHY_SECONDS} seconds")
+            unhealthy_workers[address] = time.time() + WORKER_UNHEALTHY_SECONDS
+            return False
+        except WorkerUnavailable as e:
+            logger.warning(f"{e}; falling back to subprocess")
+    
     logger.info(f"Executing: {' '.join(cmd)}")
     
     try:
@@ -301,33 +512,102 @@ def prepare_val_files(image_path, script_dir):
         logger.error(f"Error creating val files: {str(e)}")
         return None, None
 
-def prepare_dataset(job_id, files):
+def npy_path(path):
+    """Path of the decoded .npy copy of an image output"""
+    return os.path.splitext(path)[0] + ".npy"
+
+def npy_args(flag, path):
+    """Script arguments for a .npy handoff file, if the handoff is enabled"""
+    return [flag, npy_path(path)] if INTERMEDIATE_NPY else []
+
+def with_npy(outputs, *names):
+    """Add the .npy copies of the named image outputs when the handoff is enabled"""
+    if not INTERMEDIATE_NPY:
+        return outputs
+    return dict(outputs, **{f"{name}_npy": npy_path(outputs[name]) for name in names})
+
+def link_or_copy(src, dest):
+    """Hardlink src to dest, copying only if linking fails (e.g. across filesystems).
+
+    Not a symlink: a batched dataset outlives the job's temp inputs, and a
+    hardlink keeps their data alive after the originals are removed.
+    """
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+def link_with_npy(src, dest):
+    """Link a file and, if present, its decoded .npy copy under the matching name"""
+    link_or_copy(src, dest)
+    if os.path.exists(npy_path(src)):
+        link_or_copy(npy_path(src), npy_path(dest))
+
+def dataset_paths(dataset_dir, job_id):
+    """Where add_to_dataset links each of a job's files"""
+    test_dir = os.path.join(dataset_dir, "test")
+    return {
+        "cloth": os.path.join(test_dir, "cloth", f"cloth_{job_id}.jpg"),
+        "image": os.path.join(test_dir, "image", f"person_{job_id}.jpg"),
+        "parse": os.path.join(test_dir, "image-parse", f"person_{job_id}.png"),
+        "pose_img": os.path.join(test_dir, "openpose-img", f"person_{job_id}_rendered.png"),
+        "pose_json": os.path.join(test_dir, "openpose-json", f"person_{job_id}_keypoints.json"),
+        "cloth_mask": os.path.join(test_dir, "cloth-mask", f"cloth_{job_id}.jpg")
+    }
+
+def remove_from_dataset(dataset_dir, job_id):
+    """Unlink one job's files (and .npy copies) from a dataset directory"""
+    for path in dataset_paths(dataset_dir, job_id).values():
+        for linked in (path, npy_path(path)):
+            try:
+                os.remove(linked)
+            except FileNotFoundError:
+                pass
+
+def add_to_dataset(dataset_dir, job_id, files):
+    """Link one job's preprocessed files into a VITON-HD dataset directory"""
+    test_dir = os.path.join(dataset_dir, "test")
+    
+    os.makedirs(test_dir, exist_ok=True)
+    for subdir in ["cloth", "image", "image-parse", "openpose-img", "openpose-json", "cloth-mask"]:
+        os.makedirs(os.path.join(test_dir, subdir), exist_ok=True)
+    
+    # Verify all input files exist
+    for key, path in files.items():
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Required file {key} not found at {path}")
+    
+    # Link files into the dataset directory (no bytes copied on one filesystem)
+    dest = dataset_paths(dataset_dir, job_id)
+    link_or_copy(files["cloth"], dest["cloth"])
+    link_with_npy(files["image"], dest["image"])
+    link_with_npy(files["parse"], dest["parse"])
+    link_with_npy(files["pose_img"], dest["pose_img"])
+    link_or_copy(files["pose_json"], dest["pose_json"])
+    link_with_npy(files["cloth_mask"], dest["cloth_mask"])
+
+def write_test_pairs(dataset_dir, job_ids, filename="test_pairs.txt"):
+    """Write the VITON-HD pairs list for job_ids and return its path"""
+    pairs_path = os.path.join(dataset_dir, filename)
+    with open(pairs_path, 'w') as f:
+        for job_id in job_ids:
+            f.write(f"person_{job_id}.jpg cloth_{job_id}.jpg\n")
+    return pairs_path
+
+def result_filename(job_id):
+    """Name VITON-HD test.py gives the try-on output of a job's pair"""
+    # test.py names outputs '<person name up to first underscore>_<cloth name>'
+    return f"person_cloth_{job_id}.jpg"
+
+def prepare_dataset(job_id, files, dataset_dir):
     """Prepare dataset directory for virtual try-on"""
     try:
-        dataset_dir = os.path.join(TEMP_DIR, f"datasets-{job_id}")
-        test_dir = os.path.join(dataset_dir, "test")
-        
-        os.makedirs(test_dir, exist_ok=True)
-        for subdir in ["cloth", "image", "image-parse", "openpose-img", "openpose-json", "cloth-mask"]:
-            os.makedirs(os.path.join(test_dir, subdir), exist_ok=True)
-        
-        # Verify all input files exist
-        for key, path in files.items():
-            if not os.path.exists(path):
-                raise FileNotFoundError(f"Required file {key} not found at {path}")
-        
-        # Copy files to dataset directory
-        shutil.copy2(files["cloth"], os.path.join(test_dir, "cloth", f"cloth_{job_id}.jpg"))
-        shutil.copy2(files["image"], os.path.join(test_dir, "image", f"person_{job_id}.jpg"))
-        shutil.copy2(files["parse"], os.path.join(test_dir, "image-parse", f"person_{job_id}.png"))
-        shutil.copy2(files["pose_img"], os.path.join(test_dir, "openpose-img", f"person_{job_id}_rendered.png"))
-        shutil.copy2(files["pose_json"], os.path.join(test_dir, "openpose-json", f"person_{job_id}_keypoints.json"))
-        shutil.copy2(files["cloth_mask"], os.path.join(test_dir, "cloth-mask", f"cloth_{job_id}.jpg"))
+        add_to_dataset(dataset_dir, job_id, files)
         
         # Create test pairs file
-        pairs_path = os.path.join(dataset_dir, "test_pairs.txt")
-        with open(pairs_path, 'w') as f:
-            f.write(f"person_{job_id}.jpg cloth_{job_id}.jpg\n")
+        write_test_pairs(dataset_dir, [job_id])
         print(dataset_dir)    
         
         return dataset_dir
@@ -335,110 +615,596 @@ def prepare_dataset(job_id, files):
         logger.error(f"Error preparing dataset: {str(e)}")
         return None
 
-def process_job(job_id):
-    """Process a virtual try-on job"""
+def promote_result(job_id, result_path):
+    """Move a try-on result out of scratch space into RESULTS_DIR, where it
+    stays until upload_result has put it in S3"""
+    dest = os.path.join(RESULTS_DIR, f"result_{job_id}{os.path.splitext(result_path)[1]}")
+    shutil.move(result_path, dest)
+    return dest
+
+def run_try_on(name, dataset_dir, pairs_path, output_dir, batch_size=1):
+    """Run VITON-HD over every pair in pairs_path; results go to output_dir/name"""
+    os.makedirs(output_dir, exist_ok=True)
+    return run_in_env(ENV_CONFIGS["virtual_try_on"], None, None, [
+        "--name", name,
+        "--dataset_dir", dataset_dir,
+        "--dataset_list", pairs_path,
+        "--save_dir", output_dir,
+        "--batch_size", str(batch_size),
+        "--workers", "1",
+        "--load_height", "1024",
+        "--load_width", "768"
+    ])
+
+def complete_job(conn, job_id, result_path):
+    """Mark a job completed as soon as its result exists locally.
+
+    The app serves the result from the local result store until the
+    background upload lands and sets aws_url.
+    """
+    if not os.path.exists(result_path) or os.path.getsize(result_path) == 0:
+        raise Exception("Result file is empty")
+
+    with db_lock, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE images
+            SET result_image_path = %s, status = %s, pipeline_version = %s,
+                lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = %s AND lease_owner = %s
+            """,
+            (result_path, "completed", PIPELINE_VERSION, job_id, WORKER_ID)
+        )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            raise LeaseLost(f"Lost lease on job {job_id}, not completing it")
+        notify_status(cursor, job_id)
+        conn.commit()
+    released_leases.add(job_id)
+
+    # Seed the app's result cache so the first fetch is served locally. It is
+    # served without a DB lookup, so only once the completion has committed
+    result_cache.put_file(job_id, result_path)
+
+    result_upload_executor.submit(upload_result, job_id, result_path)
+
+def claim_result_upload(job_id):
+    """Claim a job's result upload unless it is done or another process is on it"""
+    with db_pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE images SET result_upload_started_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND aws_url IS NULL
+              AND (result_upload_started_at IS NULL
+                   OR result_upload_started_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+            """,
+            (job_id, RESULT_UPLOAD_STALE_SECONDS)
+        )
+        claimed = cursor.rowcount == 1
+        conn.commit()
+    return claimed
+
+def release_result_upload(job_id):
+    """Give up a claimed upload so the next daemon start resumes it"""
+    try:
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("UPDATE images SET result_upload_started_at = NULL WHERE id = %s", (job_id,))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Could not release result upload of job {job_id}: {str(e)}")
+
+def upload_result(job_id, result_path):
+    """Upload a completed job's result with retries, record its aws_url and
+    remove the local file.
+
+    The upload is claimed first, so a result is uploaded by one process even
+    when several daemons on the host resume uploads at once.
+    """
+    try:
+        if not claim_result_upload(job_id):
+            logger.info(f"Result of job {job_id} is uploaded or being uploaded elsewhere, skipping")
+            return False
+    except Exception as e:
+        logger.error(f"Could not claim result upload of job {job_id}: {str(e)}")
+        return False
+
+    for attempt in range(RESULT_UPLOAD_RETRIES):
+        result_url = upload_file_to_s3(result_path, S3_FOLDERS["results"], f"try_on_result_{job_id}.jpg")
+        if result_url:
+            break
+        if attempt < RESULT_UPLOAD_RETRIES - 1:
+            time.sleep(backoff_delay(attempt))
+    else:
+        logger.error(f"Failed to upload result of job {job_id} after {RESULT_UPLOAD_RETRIES} attempts")
+        release_result_upload(job_id)
+        return False
+
+    try:
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("UPDATE images SET aws_url = %s WHERE id = %s", (result_url, job_id))
+            notify_status(cursor, job_id)
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Could not record result URL of job {job_id}: {str(e)}")
+        release_result_upload(job_id)
+        return False
+
+    logger.info(f"Uploaded result of job {job_id} to {result_url}")
+
+    # S3 is the durable copy now, and the result cache keeps its own; the
+    # local file is only served while aws_url is unset
+    try:
+        os.remove(result_path)
+    except OSError as e:
+        logger.warning(f"Could not remove uploaded result {result_path}: {str(e)}")
+    return True
+
+def resume_result_uploads():
+    """Queue uploads for completed jobs whose result never reached S3.
+
+    Uploads claimed by a process that is still running are left alone.
+    """
+    with db_pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT id, result_image_path FROM images
+            WHERE status = 'completed' AND aws_url IS NULL AND result_image_path IS NOT NULL
+              AND (result_upload_started_at IS NULL
+                   OR result_upload_started_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+            """,
+            (RESULT_UPLOAD_STALE_SECONDS,)
+        )
+        rows = cursor.fetchall()
+
+    for job_id, result_path in rows:
+        if os.path.exists(result_path):
+            logger.info(f"Resuming result upload of job {job_id}")
+            result_upload_executor.submit(upload_result, job_id, result_path)
+
+def load_promoted_result(conn, job_id):
+    """Result path of an earlier attempt of this job that got as far as promoting it.
+
+    Everything else an attempt writes lives in its scratch directory and is
+    gone after teardown; completed preprocessing stages are picked up again
+    from the artifact cache instead.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT final_processing_status, final_processing_output FROM preprocessing_steps WHERE image_id = %s",
+            (job_id,)
+        )
+        row = cursor.fetchone()
+    if not row or row[0] != "completed" or not row[1]:
+        return None
+    outputs = json.loads(row[1])
+    return outputs["result"] if outputs_valid(outputs) else None
+
+def recorded_outputs(conn, job_id, step):
+    """Outputs an earlier attempt of this job recorded for a completed step, if any"""
+    with db_lock, conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {step}_status, {step}_output FROM preprocessing_steps WHERE image_id = %s",
+            (job_id,)
+        )
+        row = cursor.fetchone()
+    if not row or row[0] != "completed" or not row[1]:
+        return None
+    return json.loads(row[1])
+
+def outputs_valid(outputs):
+    """Check that every recorded output file exists, is non-empty and decodes"""
+    if not outputs:
+        return False
+    for path in outputs.values():
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return False
+        if path.lower().endswith(('.jpg', '.jpeg', '.png')) and not validate_image(path):
+            return False
+    return True
+
+def stage_cache_key(step, input_digest):
+    """Artifact-cache key of a stage's outputs for the given input digest"""
+    # Entries with and without the .npy copies are kept apart: an entry never
+    # gains files, so a lookup asking for more would miss it forever
+    handoff = ";npy" if INTERMEDIATE_NPY else ""
+    return ArtifactCache.make_key(stage_version(step) + handoff, input_digest)
+
+def restore_artifacts(job_id, step, cache_key, outputs):
+    """Copy a cached entry to outputs; an entry whose files do not validate is dropped"""
+    if not artifact_cache.get(step, cache_key, outputs):
+        return False
+    if not outputs_valid(outputs):
+        logger.warning(f"Job {job_id}: cached {step} outputs failed validation, discarding entry")
+        artifact_cache.discard(step, cache_key)
+        return False
+    return True
+
+def run_stage(conn, job_id, step, stage_fn, input_digest=None, outputs=None, results=None):
+    """Run one stage, recording processing/completed/failed in preprocessing_steps.
+
+    When input_digest is given the stage's outputs ({name: path}) are looked
+    up in the artifact cache first and stored there after a successful run;
+    the cache entry, not the scratch paths, is recorded as the step's output.
+    A retried job leaves a step it already completed as it is when the entry
+    it recorded is still there and the restored files validate. Restored
+    files that do not validate drop the entry and the stage runs again.
+    stage_fn may return the outputs when they are only known after it ran.
+    No stage is started once the job's lease is lost. Failures other than
+    ScratchQuotaExceeded are retried according to STAGE_RETRY_POLICIES. The
+    outputs of the stage are stored in results[step].
+    """
+    check_lease(job_id)
+    policy = STAGE_RETRY_POLICIES.get(step, {})
+    retries = policy.get("retries", 0)
+    cache_key = stage_cache_key(step, input_digest) if input_digest else None
+
+    if cache_key and recorded_outputs(conn, job_id, step) == {"artifact_cache": artifact_cache.entry_dir(step, cache_key)}:
+        if restore_artifacts(job_id, step, cache_key, outputs):
+            logger.info(f"Job {job_id}: {step} already completed, resumed from its recorded artifact")
+            if results is not None:
+                results[step] = outputs
+            return
+
+    update_db_status(conn, job_id, step, "processing")
+    try:
+        if cache_key and restore_artifacts(job_id, step, cache_key, outputs):
+            logger.info(f"Job {job_id}: {step} served from artifact cache")
+        else:
+            for attempt in range(retries + 1):
+                try:
+                    outputs = stage_fn() or outputs
+                    break
+                except ScratchQuotaExceeded:
+                    # Running the stage again would write the same files
+                    raise
+                except Exception as e:
+                    if attempt == retries:
+                        raise
+                    logger.warning(f"Job {job_id}: {step} attempt {attempt + 1} failed ({str(e)}), retrying")
+                    time.sleep(policy.get("delay", 0))
+            if cache_key and not artifact_cache.put(step, cache_key, outputs):
+                cache_key = None
+        # Scratch paths are gone once the job ends; record where the outputs
+        # persist, unless they could not be cached
+        recorded = {"artifact_cache": artifact_cache.entry_dir(step, cache_key)} if cache_key else outputs
+        update_db_status(conn, job_id, step, "completed", recorded)
+        if results is not None:
+            results[step] = outputs
+    except Exception as e:
+        update_db_status(conn, job_id, step, "failed")
+        raise e
+
+def run_stage_graph(stages, dependencies, max_workers=MAX_STAGE_WORKERS):
+    """Run stages concurrently as soon as their dependencies have completed.
+
+    stages maps a stage name to a callable, dependencies maps a stage name to
+    the stages it needs first. On the first failure no new stages are started,
+    running ones are allowed to finish and the failure is re-raised.
+    """
+    remaining = {name: set(dependencies.get(name, [])) for name in stages}
+    for name, deps in remaining.items():
+        unknown = deps - set(stages)
+        if unknown:
+            raise ValueError(f"Stage {name} depends on unknown stages {sorted(unknown)}")
+
+    done = set()
+    running = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while remaining or running:
+            if error is None:
+                ready = [name for name, deps in remaining.items() if deps <= done]
+                if not ready and not running:
+                    raise ValueError(f"Stage graph has a cycle: {sorted(remaining)}")
+                for name in ready:
+                    del remaining[name]
+                    running[executor.submit(stages[name])] = name
+            elif not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    done.add(name)
+                except Exception as e:
+                    logger.error(f"Stage {name} failed: {str(e)}")
+                    if error is None:
+                        error = e
+
+    if error is not None:
+        raise error
+
+def claim_job(conn, job_id, retry_failed=False):
+    """Claim a single pending job (or, with retry_failed, a failed one).
+
+    Jobs that are processing or completed are never claimed: a --job-id run
+    queued by /generate may start after a daemon has already finished the job.
+    """
+    statuses = ["pending", "failed"] if retry_failed else ["pending"]
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE images
+            SET status = 'processing', lease_owner = %s,
+                lease_expires_at = NOW() + %s * INTERVAL '1 second', attempts = attempts + 1
+            WHERE id = %s AND status = ANY(%s)
+            RETURNING id
+            """,
+            (WORKER_ID, LEASE_SECONDS, job_id, statuses)
+        )
+        claimed = cursor.fetchone() is not None
+        if claimed:
+            notify_status(cursor, job_id)
+    conn.commit()
+    if claimed:
+        lost_leases.discard(job_id)
+        released_leases.discard(job_id)
+    return claimed
+
+def claim_pending_jobs(conn, limit):
+    """Atomically claim up to limit pending jobs, oldest first.
+
+    SKIP LOCKED lets any number of daemons run this at once: rows locked by
+    another claim are skipped, so every pending job goes to exactly one worker.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE images
+            SET status = 'processing', lease_owner = %s,
+                lease_expires_at = NOW() + %s * INTERVAL '1 second', attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM images
+                WHERE status = 'pending'
+                ORDER BY created_at ASC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id
+            """,
+            (WORKER_ID, LEASE_SECONDS, limit)
+        )
+        job_ids = sorted(job_id for (job_id,) in cursor.fetchall())
+        notify_status(cursor, *job_ids)
+    conn.commit()
+    lost_leases.difference_update(job_ids)
+    released_leases.difference_update(job_ids)
+    return job_ids
+
+def renew_leases(conn, job_ids):
+    """Extend this worker's lease on job_ids; returns the ids still held"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE images SET lease_expires_at = NOW() + %s * INTERVAL '1 second'
+            WHERE id = ANY(%s) AND lease_owner = %s AND status = 'processing'
+            RETURNING id
+            """,
+            (LEASE_SECONDS, list(job_ids), WORKER_ID)
+        )
+        held = [job_id for (job_id,) in cursor.fetchall()]
+    conn.commit()
+    return held
+
+class LeaseLost(Exception):
+    """This worker no longer owns the job; another worker may have claimed it"""
+
+def check_lease(job_id):
+    """Raise LeaseLost if the heartbeat found the job's lease gone"""
+    if job_id in lost_leases:
+        raise LeaseLost(f"Lost lease on job {job_id}")
+
+class LeaseHeartbeat(threading.Thread):
+    """Background thread renewing the lease on claimed jobs until stopped.
+
+    Jobs this worker already finished are dropped from the heartbeat; the
+    others whose lease could not be renewed are added to lost_leases, which
+    stops them before their next stage (check_lease).
+    """
+
+    def __init__(self, job_ids):
+        super().__init__(daemon=True)
+        self.job_ids = list(job_ids)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(LEASE_HEARTBEAT_SECONDS):
+            self.job_ids = [job_id for job_id in self.job_ids if job_id not in released_leases]
+            if not self.job_ids:
+                continue
+            try:
+                with db_pool.connection() as conn:
+                    held = renew_leases(conn, self.job_ids)
+                # A job finished between the filter above and the renewal is not lost
+                lost = set(self.job_ids) - set(held) - released_leases
+                if lost:
+                    logger.warning(f"Lost lease on jobs {sorted(lost)}, abandoning them")
+                    lost_leases.update(lost)
+                    self.job_ids = held
+            except Exception as e:
+                logger.warning(f"Lease heartbeat failed: {str(e)}")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def reap_expired_leases(conn):
+    """Requeue (or fail, after MAX_ATTEMPTS) jobs whose lease has expired.
+
+    Steps left at 'processing' by the dead worker go back to 'pending' for a
+    requeued job and to 'failed' for a failed one; completed steps are kept.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE images
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                lease_owner = NULL, lease_expires_at = NULL
+            WHERE status = 'processing' AND lease_expires_at < NOW()
+            RETURNING id, status
+            """,
+            (MAX_ATTEMPTS,)
+        )
+        reaped = cursor.fetchall()
+
+        for new_status in ("pending", "failed"):
+            job_ids = [job_id for job_id, status in reaped if status == new_status]
+            if not job_ids:
+                continue
+            step_status = "pending" if new_status == "pending" else "failed"
+            assignments = ", ".join(
+                f"{step}_status = CASE WHEN {step}_status = 'processing' THEN '{step_status}' ELSE {step}_status END"
+                for step in PIPELINE_STEPS
+            )
+            cursor.execute(
+                f"UPDATE preprocessing_steps SET {assignments} WHERE image_id = ANY(%s)",
+                (job_ids,)
+            )
+            logger.warning(f"Lease expired, marked {new_status}: jobs {job_ids}")
+
+        if any(status == "pending" for _, status in reaped):
+            cursor.execute("SELECT pg_notify(%s, %s)", (JOB_NOTIFY_CHANNEL, "requeued"))
+        notify_status(cursor, *(job_id for job_id, _ in reaped))
+    conn.commit()
+    return reaped
+
+def process_job(job_id, batch_scratch=None, claimed=False, retry_failed=False):
+    """Process a virtual try-on job.
+
+    With batch_scratch the try-on step is deferred: the job's preprocessed
+    files are added to the dataset in that batch scratch directory and
+    process_batch finishes the job.
+    claimed means the caller already moved the job to 'processing' and keeps
+    its lease alive; otherwise only a pending job (or a failed one, with
+    retry_failed) is claimed.
+    """
     logger.info(f"Starting job {job_id}")
     conn = None
-    person_orig = None
-    cloth_orig = None
+    heartbeat = None
+    scratch = None
     
     try:
-        # Initialize database connection
-        conn = psycopg2.connect(**DB_PARAMS)
+        # Borrow a database connection for the whole job
+        conn = db_pool.getconn()
         
         # Update the main job status in images table
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "UPDATE images SET status = 'processing' WHERE id = %s",
-                (job_id,)
-            )
-            conn.commit()
+        if not claimed:
+            if not claim_job(conn, job_id, retry_failed):
+                logger.info(f"Job {job_id} is not pending (claimed by another worker or finished), skipping")
+                return False
+            heartbeat = LeaseHeartbeat([job_id])
+            heartbeat.start()
 
         # Get job details
         with conn.cursor() as cursor:
             cursor.execute(
-                "SELECT person_image_path, cloth_image_path FROM images WHERE id = %s",
+                """
+                SELECT person_image_path, cloth_image_path, person_image_hash, cloth_image_hash
+                FROM images WHERE id = %s
+                """,
                 (job_id,)
             )
-            person_url, cloth_url = cursor.fetchone()
-        
-        # Generate unique filenames
-        run_id = str(uuid.uuid4())[:8]
-        person_orig = os.path.join(TEMP_DIR, f"person_{job_id}_{run_id}.jpg")
-        cloth_orig = os.path.join(TEMP_DIR, f"cloth_{job_id}_{run_id}.jpg")
+            person_url, cloth_url, person_hash, cloth_hash = cursor.fetchone()
+
+        # An earlier attempt promoted its result but died before completing the job
+        previous_result = load_promoted_result(conn, job_id)
+        if previous_result:
+            logger.info(f"Job {job_id}: reusing result {previous_result} of an earlier attempt")
+            complete_job(conn, job_id, previous_result)
+            # Nothing is left for a batched try-on to do
+            return batch_scratch is None
         
-        # Download images with retries
-        if not download_with_retry(person_url, person_orig):
-            raise Exception("Failed to download person image after 3 attempts")
+        # Everything this job writes lives in its scratch directory
+        scratch = JobScratch(SCRATCH_ROOT, f"job_{job_id}", SCRATCH_QUOTA_BYTES).create()
+        person_orig = scratch.path("input", f"person_{job_id}.jpg")
+        cloth_orig = scratch.path("input", f"cloth_{job_id}.jpg")
         
-        if not download_with_retry(cloth_url, cloth_orig):
-            raise Exception("Failed to download cloth image after 3 attempts")
-            
-        # Validate downloaded images
-        if not validate_image(person_orig):
-            raise Exception("Invalid person image file")
-            
-        if not validate_image(cloth_orig):
-            raise Exception("Invalid cloth image file")
+        def download_person():
+            if not download_with_retry(person_url, person_orig):
+                raise Exception("Failed to download person image after 3 attempts")
 
-        # 1. Remove background with better error handling
-        update_db_status(conn, job_id, "remove_bg", "processing")
-        person_nobg = os.path.join(PROCESSED_DIR, "image", f"person_{job_id}_nobg.jpg")
-        
-        try:
-            if not run_in_env(ENV_CONFIGS["remove_bg"], person_orig, person_nobg):
+            if not validate_image(person_orig):
+                raise Exception("Invalid person image file")
+
+            check_digest(person_orig, person_hash)
+
+        def download_cloth():
+            if not download_with_retry(cloth_url, cloth_orig):
+                raise Exception("Failed to download cloth image after 3 attempts")
+
+            if not validate_image(cloth_orig):
+                raise Exception("Invalid cloth image file")
+
+            check_digest(cloth_orig, cloth_hash)
+
+        # Download images concurrently, with retries. The person photo is only
+        # read by remove_bg, so it is skipped when its content hash was stored
+        # at upload time and remove_bg is already in the artifact cache;
+        # remove_bg still fetches it should that entry be gone by then. Stored
+        # hashes are checked against the downloaded bytes before any stage
+        # output keyed by them is cached.
+        person_cached = bool(person_hash) and os.path.isdir(
+            artifact_cache.entry_dir("remove_bg", stage_cache_key("remove_bg", person_hash)))
+        downloads = [download_executor.submit(download_cloth)]
+        if not person_cached:
+            downloads.append(download_executor.submit(download_person))
+        for download in downloads:
+            download.result()
+
+        person_digest = person_hash or file_digest(person_orig)
+        cloth_digest = cloth_hash or file_digest(cloth_orig)
+        if not (person_hash and cloth_hash):
+            record_input_hashes(conn, job_id, person_digest, cloth_digest)
+
+        person_nobg = scratch.path("image", f"person_{job_id}_nobg.jpg")
+        cloth_mask = scratch.path("cloth-mask", f"cloth_{job_id}.jpg")
+        cloth_masked = scratch.path("cloth-mask", f"cloth_{job_id}_masked.jpg")
+        parse_output = scratch.path("image-parse", f"person_{job_id}.png")
+        pose_img = scratch.path("openpose-img", f"person_{job_id}_pose.png")
+        pose_json = scratch.path("openpose-json", f"person_{job_id}_pose.json")
+        output_dir = scratch.subdir("try_on_results")
+
+        # 1. Remove background
+        def remove_bg():
+            if not os.path.exists(person_orig):
+                download_person()
+
+            if not run_in_env(ENV_CONFIGS["remove_bg"], person_orig, person_nobg,
+                              npy_args("--npy-output", person_nobg)):
                 raise Exception("Background removal failed")
             
             # Verify output was created
             if not os.path.exists(person_nobg) or os.path.getsize(person_nobg) == 0:
                 raise Exception("Background removal produced empty output")
-                
-            update_db_status(conn, job_id, "remove_bg", "completed")
-        except Exception as e:
-            update_db_status(conn, job_id, "remove_bg", "failed")
-            raise e
 
         # 2. Create cloth mask
-        update_db_status(conn, job_id, "cloth_mask", "processing")
-        cloth_mask = os.path.join(PROCESSED_DIR, "cloth-mask", f"cloth_{job_id}.jpg")
-        cloth_masked = os.path.join(PROCESSED_DIR, "cloth-mask", f"cloth_{job_id}_masked.jpg")
-        
-        try:
-            if not run_in_env(ENV_CONFIGS["cloth_mask"], cloth_orig, cloth_mask, ["--masked-output", cloth_masked]):
+        def create_cloth_mask():
+            if not run_in_env(ENV_CONFIGS["cloth_mask"], cloth_orig, cloth_mask,
+                              ["--masked-output", cloth_masked] + npy_args("--npy-output", cloth_mask)):
                 raise Exception("Cloth mask creation failed")
                 
             if not os.path.exists(cloth_mask) or os.path.getsize(cloth_mask) == 0:
                 raise Exception("Cloth mask produced empty output")
-                
-            update_db_status(conn, job_id, "cloth_mask", "completed")
-        except Exception as e:
-            update_db_status(conn, job_id, "cloth_mask", "failed")
-            raise e
 
         # 3. Image parsing
-        update_db_status(conn, job_id, "segmentation", "processing")
-        parse_output = os.path.join(PROCESSED_DIR, "image-parse", f"person_{job_id}.png")
-        val_id, val_txt = prepare_val_files(person_nobg, os.path.dirname(ENV_CONFIGS["inf_pgn"]["script_path"]))
-        
-        try:
-            if not run_in_env(ENV_CONFIGS["inf_pgn"], person_nobg, parse_output, ["--val-id-file", val_id, "--val-file", val_txt]):
+        def segmentation():
+            val_id, val_txt = prepare_val_files(person_nobg, scratch.subdir("segmentation"))
+            if not run_in_env(ENV_CONFIGS["inf_pgn"], person_nobg, parse_output,
+                              ["--val-id-file", val_id, "--val-file", val_txt]
+                              + npy_args("--npy-input", person_nobg) + npy_args("--npy-output", parse_output)):
                 raise Exception("Image parsing failed")
                 
             if not os.path.exists(parse_output) or os.path.getsize(parse_output) == 0:
                 raise Exception("Image parsing produced empty output")
-                
-            update_db_status(conn, job_id, "segmentation", "completed")
-        except Exception as e:
-            update_db_status(conn, job_id, "segmentation", "failed")
-            raise e
 
         # 4. OpenPose
-        update_db_status(conn, job_id, "pose_generation", "processing")
-        pose_img = os.path.join(PROCESSED_DIR, "openpose-img", f"person_{job_id}_pose.png")
-        pose_json = os.path.join(PROCESSED_DIR, "openpose-json", f"person_{job_id}_pose.json")
-        
-        try:
-            if not run_in_env(ENV_CONFIGS["openpose"], person_nobg, pose_img, ["--json-output", pose_json]):
+        def pose_generation():
+            if not run_in_env(ENV_CONFIGS["openpose"], person_nobg, pose_img,
+                              ["--json-output", pose_json]
+                              + npy_args("--npy-input", person_nobg) + npy_args("--npy-output", pose_img)):
                 raise Exception("Pose generation failed")
                 
             if not os.path.exists(pose_img) or os.path.getsize(pose_img) == 0:
@@ -446,40 +1212,24 @@ def process_job(job_id):
                 
             if not os.path.exists(pose_json) or os.path.getsize(pose_json) == 0:
                 raise Exception("Pose JSON produced empty output")
-                
-            update_db_status(conn, job_id, "pose_generation", "completed")
-        except Exception as e:
-            update_db_status(conn, job_id, "pose_generation", "failed")
-            raise e
 
-        # 5. Virtual try-on
-        update_db_status(conn, job_id, "final_processing", "processing")
-        output_dir = os.path.join(PROCESSED_DIR, "try_on_results", f"job_{job_id}")
-        os.makedirs(output_dir, exist_ok=True)
-        
-        dataset_dir = prepare_dataset(job_id, {
+        dataset_files = {
             "cloth": cloth_orig,
             "image": person_nobg,
             "parse": parse_output,
             "pose_img": pose_img,
             "pose_json": pose_json,
             "cloth_mask": cloth_mask
-        })
-        
-        if not dataset_dir:
-            raise Exception("Failed to prepare dataset directory")
-        
-        try:
-            if not run_in_env(ENV_CONFIGS["virtual_try_on"], None, None, [
-                "--name", f"job_{job_id}",
-                "--dataset_dir", dataset_dir,
-                "--dataset_list", os.path.join(dataset_dir, "test_pairs.txt"),
-                "--save_dir", output_dir,
-                "--batch_size", "1",
-                "--workers", "1",
-                "--load_height", "1024",
-                "--load_width", "768"
-            ]):
+        }
+
+        # 5. Virtual try-on
+        def final_processing():
+            dataset_dir = prepare_dataset(job_id, dataset_files, scratch.subdir("dataset"))
+            
+            if not dataset_dir:
+                raise Exception("Failed to prepare dataset directory")
+            
+            if not run_try_on(f"job_{job_id}", dataset_dir, os.path.join(dataset_dir, "test_pairs.txt"), output_dir):
                 raise Exception("Virtual try-on failed")
             
             # Find and upload result
@@ -491,90 +1241,295 @@ def process_job(job_id):
             if not result_files:
                 raise Exception("No result files found in output directory")
                 
-            result_path = os.path.join(result_dir, result_files[0])
-            if not os.path.exists(result_path) or os.path.getsize(result_path) == 0:
-                raise Exception("Result file is empty")
-                
-            result_url = upload_file_to_s3(result_path, S3_FOLDERS["results"], f"try_on_result_{job_id}.jpg")
-            if not result_url:
-                raise Exception("Failed to upload result to S3")
-            
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE images SET result_image_path = %s, aws_url = %s, status = %s WHERE id = %s",
-                    (result_path, result_url, "completed", job_id)
-                )
-                conn.commit()
-            
-            update_db_status(conn, job_id, "final_processing", "completed")
-            logger.info(f"Completed job {job_id}")
+            return {"result": promote_result(job_id, os.path.join(result_dir, result_files[0]))}
+
+        stages = {
+            "remove_bg": remove_bg,
+            "cloth_mask": create_cloth_mask,
+            "segmentation": segmentation,
+            "pose_generation": pose_generation,
+            "final_processing": final_processing,
+        }
+        if batch_scratch:
+            del stages["final_processing"]
+
+        def within_quota(stage_fn):
+            def run():
+                outputs = stage_fn()
+                scratch.check()
+                return outputs
+            return run
+        stages = {step: within_quota(fn) for step, fn in stages.items()}
+
+        # Per-person and per-garment outputs that can be reused across jobs
+        cached_outputs = {
+            "remove_bg": (person_digest, with_npy({"person_nobg": person_nobg}, "person_nobg")),
+            "cloth_mask": (cloth_digest, with_npy({"cloth_mask": cloth_mask, "cloth_masked": cloth_masked}, "cloth_mask")),
+            "segmentation": (person_digest, with_npy({"parse": parse_output}, "parse")),
+            "pose_generation": (person_digest, with_npy({"pose_img": pose_img, "pose_json": pose_json}, "pose_img"))
+        }
+        results = {}
+        run_stage_graph(
+            {step: partial(run_stage, conn, job_id, step, fn, *cached_outputs.get(step, (None, None)),
+                           results=results)
+             for step, fn in stages.items()},
+            STAGE_DEPENDENCIES
+        )
+        logger.info(f"Artifact cache: {artifact_cache.stats()}")
+
+        if batch_scratch:
+            batch_dataset = batch_scratch.subdir("dataset")
+            try:
+                add_to_dataset(batch_dataset, job_id, dataset_files)
+                batch_scratch.check()
+            except Exception:
+                # Leave the shared dataset (and its quota) to the other jobs
+                remove_from_dataset(batch_dataset, job_id)
+                raise
+            update_db_status(conn, job_id, "final_processing", "processing")
+            logger.info(f"Job {job_id} preprocessed, queued for batched try-on")
             return True
-            
-        except Exception as e:
-            update_db_status(conn, job_id, "final_processing", "failed")
-            raise e
+
+        complete_job(conn, job_id, results["final_processing"]["result"])
+        logger.info(f"Completed job {job_id}")
+        return True
         
+    except LeaseLost as e:
+        logger.warning(f"Abandoning job {job_id}: {str(e)}")
+        return False
     except Exception as e:
         logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
         if conn:
             try:
                 with conn.cursor() as cursor:
                     cursor.execute(
-                        "UPDATE images SET status = 'failed' WHERE id = %s",
-                        (job_id,)
+                        """
+                        UPDATE images SET status = 'failed', lease_owner = NULL, lease_expires_at = NULL
+                        WHERE id = %s AND lease_owner = %s
+                        """,
+                        (job_id, WORKER_ID)
                     )
+                    if cursor.rowcount:
+                        released_leases.add(job_id)
+                    notify_status(cursor, job_id)
                     conn.commit()
             except Exception as db_error:
                 logger.error(f"Failed to update job status to failed: {str(db_error)}")
         return False
     finally:
-        # Cleanup temporary files
-        for f in [person_orig, cloth_orig]:
-            try:
-                if f and os.path.exists(f):
-                    os.remove(f)
-            except Exception as e:
-                logger.warning(f"Could not remove temp file {f}: {str(e)}")
+        if heartbeat:
+            heartbeat.stop()
+
+        # Tear down scratch space; the result was promoted and reusable
+        # artifacts were copied into the artifact cache
+        if scratch:
+            scratch.cleanup()
                 
         if conn:
-            conn.close()
+            db_pool.putconn(conn)
 
-def check_pending_jobs():
-    """Check for and process pending jobs"""
+def fail_job(conn, job_id):
+    """Mark a job and its final_processing step failed, if this worker still owns it"""
+    update_db_status(conn, job_id, "final_processing", "failed")
     try:
-        conn = psycopg2.connect(**DB_PARAMS)
-        with conn.cursor() as cursor:
+        with db_lock, conn.cursor() as cursor:
             cursor.execute(
-                "SELECT id FROM images WHERE status = 'pending' ORDER BY created_at ASC LIMIT 5 FOR UPDATE"
+                """
+                UPDATE images SET status = 'failed', lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = %s AND lease_owner = %s
+                """,
+                (job_id, WORKER_ID)
             )
-            jobs = cursor.fetchall()
-            
-            if jobs:
-                logger.info(f"Found {len(jobs)} pending jobs")
-                for (job_id,) in jobs:
-                    process_job(job_id)
+            owned = cursor.rowcount > 0
+            notify_status(cursor, job_id)
+            conn.commit()
+    except Exception as db_error:
+        logger.error(f"Failed to update job status to failed: {str(db_error)}")
+        conn.rollback()
+        return
+    if owned:
+        released_leases.add(job_id)
+    else:
+        logger.warning(f"Lost lease on job {job_id}, leaving its status to the new owner")
+
+def process_batch(job_ids, batch_size):
+    """Preprocess jobs separately, then run VITON-HD on them in batches.
+
+    Checkpoints are loaded once per batch instead of once per job, and the
+    networks run with a real batch size. Each result is fanned back out to
+    its own images row.
+    """
+    batch_id = str(uuid.uuid4())[:8]
+    with JobScratch(SCRATCH_ROOT, f"batch_{batch_id}", SCRATCH_QUOTA_BYTES * len(job_ids)) as scratch:
+        ready = [job_id for job_id in job_ids if process_job(job_id, scratch, claimed=True)]
+        if ready:
+            run_batched_try_on(batch_id, ready, batch_size, scratch)
+
+def run_batched_try_on(batch_id, ready, batch_size, scratch):
+    """Run VITON-HD over preprocessed jobs in chunks and complete each job.
+
+    The batch scratch quota is checked after every chunk; the jobs of a
+    chunk that overran it are failed.
+    """
+    dataset_dir = scratch.subdir("dataset")
+    output_dir = scratch.subdir("try_on_results")
+    conn = db_pool.getconn()
+    try:
+        for start in range(0, len(ready), batch_size):
+            chunk = ready[start:start + batch_size]
+            name = f"batch_{batch_id}_{start // batch_size}"
+            logger.info(f"Running batched try-on {name} for jobs {chunk}")
+
+            # VITON-HD drops incomplete batches, so each run uses its chunk size
+            pairs_path = write_test_pairs(dataset_dir, chunk, f"test_pairs_{start // batch_size}.txt")
+            error = None if run_try_on(name, dataset_dir, pairs_path, output_dir, len(chunk)) else "Virtual try-on failed"
+            try:
+                scratch.check()
+            except ScratchQuotaExceeded as e:
+                error = str(e)
+
+            for job_id in chunk:
+                result_path = os.path.join(output_dir, name, result_filename(job_id))
+                try:
+                    if error:
+                        raise Exception(error)
+                    if not os.path.exists(result_path):
+                        raise Exception("No result file found in output directory")
+                    check_lease(job_id)
+                    result_path = promote_result(job_id, result_path)
+                    update_db_status(conn, job_id, "final_processing", "completed", {"result": result_path})
+                    complete_job(conn, job_id, result_path)
+                    logger.info(f"Completed job {job_id}")
+                except LeaseLost as e:
+                    logger.warning(f"Abandoning job {job_id}: {str(e)}")
+                except Exception as e:
+                    logger.error(f"Job {job_id} failed: {str(e)}")
+                    fail_job(conn, job_id)
+
+            # Results were promoted; drop what is left so later chunks get the space
+            shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+    finally:
+        db_pool.putconn(conn)
+
+def check_pending_jobs(batch_size=1):
+    """Claim and process pending jobs, returning how many were claimed.
+
+    Only one job is claimed at a time (batch_size when batching), so the
+    other daemons can pull the remaining jobs in the meantime.
+    """
+    jobs = []
+    try:
+        with db_pool.connection() as conn:
+            reap_expired_leases(conn)
+            jobs = claim_pending_jobs(conn, batch_size)
         
-        conn.close()
+        if jobs:
+            logger.info(f"Claimed {len(jobs)} pending jobs")
+            # Hold the lease on every claimed job, including those still waiting their turn
+            # for the batched try-on
+            heartbeat = LeaseHeartbeat(jobs)
+            heartbeat.start()
+            try:
+                if batch_size > 1:
+                    process_batch(jobs, batch_size)
+                else:
+                    for job_id in jobs:
+                        process_job(job_id, claimed=True)
+            finally:
+                heartbeat.stop()
     except Exception as e:
         logger.error(f"Error checking jobs: {str(e)}")
+    return len(jobs)
+
+def purge_idempotency_keys():
+    """Delete Idempotency-Keys past their TTL"""
+    try:
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'",
+                (IDEMPOTENCY_KEY_TTL,)
+            )
+            purged = cursor.rowcount
+            conn.commit()
+        if purged:
+            logger.info(f"Purged {purged} expired idempotency keys")
+    except Exception as e:
+        logger.error(f"Could not purge idempotency keys: {str(e)}")
+
+def listen_for_jobs():
+    """Open an autocommit connection LISTENing for new-job notifications.
+
+    This connection stays in LISTEN mode for the daemon's lifetime, so it is
+    opened directly rather than borrowed from db_pool.
+    """
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {JOB_NOTIFY_CHANNEL}")
+        return conn
+    except Exception as e:
+        logger.error(f"Could not listen for job notifications: {str(e)}")
+        return None
+
+def wait_for_jobs(listen_conn, timeout):
+    """Sleep until a job is NOTIFYed or timeout seconds pass.
+
+    Returns the listening connection to reuse, or None if it was lost (the
+    next call then falls back to a plain sleep and reconnects afterwards).
+    """
+    if listen_conn is None:
+        time.sleep(timeout)
+        return listen_for_jobs()
+
+    try:
+        if select.select([listen_conn], [], [], timeout) != ([], [], []):
+            listen_conn.poll()
+            if listen_conn.notifies:
+                logger.info(f"Woken by {len(listen_conn.notifies)} job notification(s)")
+            del listen_conn.notifies[:]
+        return listen_conn
+    except Exception as e:
+        logger.error(f"Lost job notification connection: {str(e)}")
+        try:
+            listen_conn.close()
+        except Exception:
+            pass
+        return None
 
 def main():
     parser = argparse.ArgumentParser(description="Virtual Try-On Processing Service")
     parser.add_argument("--job-id", type=int, help="Process specific job ID")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="With --job-id, also rerun the job if it has failed")
     parser.add_argument("--daemon", action="store_true", help="Run in daemon mode")
-    parser.add_argument("--interval", type=int, default=60, help="Polling interval in seconds")
+    parser.add_argument("--interval", type=int, default=60,
+                        help="Fallback polling interval in seconds (new jobs wake the daemon via NOTIFY)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Run virtual try-on for up to this many preprocessed jobs at once")
     
     args = parser.parse_args()
     
     if args.job_id:
-        process_job(args.job_id)
+        process_job(args.job_id, retry_failed=args.retry_failed)
     elif args.daemon:
         logger.info(f"Starting daemon mode (interval: {args.interval}s)")
+        remove_stale(SCRATCH_ROOT, SCRATCH_STALE_SECONDS)
+        resume_result_uploads()
+        # LISTEN before the first check so no notification is missed in between
+        listen_conn = listen_for_jobs()
+        next_purge = 0
         while True:
-            check_pending_jobs()
-            time.sleep(args.interval)
+            if time.monotonic() >= next_purge:
+                purge_idempotency_keys()
+                next_purge = time.monotonic() + IDEMPOTENCY_PURGE_SECONDS
+            # Keep draining while there is work; only sleep once the queue is empty
+            if not check_pending_jobs(args.batch_size):
+                listen_conn = wait_for_jobs(listen_conn, args.interval)
     else:
-        check_pending_jobs()
+        # Drain the queue once
+        while check_pending_jobs(args.batch_size):
+            pass
 
 if __name__ == "__main__":
     try:
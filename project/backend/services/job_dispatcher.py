@@ -0,0 +1,60 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger("job_dispatcher")
+
+
+class JobDispatcher:
+    """Runs submitted jobs on a fixed number of worker threads.
+
+    Jobs wait in a bounded in-memory queue. When the queue is full, submit()
+    refuses the job; it stays 'pending' in the database and a daemon
+    (generate_image_service.py --daemon) picks it up instead.
+    """
+
+    def __init__(self, run_job, max_workers, queue_size):
+        self.run_job = run_job
+        self.max_workers = max_workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+        for i in range(max_workers):
+            threading.Thread(target=self._worker, name=f"job-dispatcher-{i}", daemon=True).start()
+
+    def submit(self, job_id):
+        """Queue a job; returns False if the queue is full"""
+        try:
+            self.queue.put_nowait(job_id)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            logger.warning(f"Dispatch queue full, job {job_id} left pending for the daemon")
+            return False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "active_workers": self.active,
+                "max_workers": self.max_workers,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "rejected": self.rejected
+            }
+
+    def _worker(self):
+        while True:
+            job_id = self.queue.get()
+            with self.lock:
+                self.active += 1
+            try:
+                self.run_job(job_id)
+            except Exception as e:
+                logger.error(f"Error running job {job_id}: {e}")
+            finally:
+                with self.lock:
+                    self.active -= 1
+                self.queue.task_done()
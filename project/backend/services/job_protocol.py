@@ -0,0 +1,30 @@
+"""Names and settings the Flask app and the orchestrator must agree on.
+
+Both processes import this module, so the NOTIFY channels, the
+Idempotency-Key TTL and the layout of content-addressed upload keys are
+defined once.
+"""
+
+import os
+import re
+
+from dotenv import load_dotenv
+
+# Imported before either process loads its .env
+load_dotenv()
+
+# Channel the /generate route NOTIFYs on when it queues a job; orchestrator
+# daemons LISTEN on it
+JOB_NOTIFY_CHANNEL = "image_jobs"
+
+# Channel the orchestrator notifies (payload: job id) whenever a job or one
+# of its steps changes status; the app streams these to
+# /status/<job_id>/stream clients
+JOB_STATUS_CHANNEL = "job_status"
+
+# Seconds an Idempotency-Key on /generate maps to its original job
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", 24 * 60 * 60))
+
+# File name of keys written by /upload-images:
+# <prefix>/<sha256 of the content><ext>
+CONTENT_KEY_PATTERN = re.compile(r"([0-9a-f]{64})\.\w+")
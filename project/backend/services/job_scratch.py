@@ -0,0 +1,97 @@
+"""Per-job scratch directories for intermediate files.
+
+Every job (or batch) works in its own directory under a scratch root,
+ideally a RAM-backed filesystem such as tmpfs (/dev/shm), so intermediate
+images never hit persistent disk. The directory is removed when the job
+ends, whether it succeeded or failed; anything worth keeping (the try-on
+result, artifact-cache entries) has to be copied out before that.
+
+A tmpfs mount cannot limit a single directory, so the per-job quota is
+enforced by the caller: check() raises ScratchQuotaExceeded once the
+directory has grown past quota_bytes.
+"""
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+
+logger = logging.getLogger("job_scratch")
+
+
+class ScratchQuotaExceeded(Exception):
+    """A job wrote more to its scratch directory than its quota allows"""
+
+
+class JobScratch:
+    """Scratch directory of one job, removed by cleanup() or on leaving a with block"""
+
+    def __init__(self, root, name, quota_bytes):
+        self.root = root
+        self.name = name
+        self.quota_bytes = quota_bytes
+        self.dir = None
+
+    def create(self):
+        os.makedirs(self.root, exist_ok=True)
+        free = shutil.disk_usage(self.root).free
+        if free < self.quota_bytes:
+            logger.warning(f"Only {free} bytes free under {self.root}, {self.name} may run out of scratch space")
+        self.dir = tempfile.mkdtemp(prefix=f"{self.name}-", dir=self.root)
+        return self
+
+    def path(self, *parts):
+        """Path of a file inside the scratch directory; parent directories are created"""
+        full_path = os.path.join(self.dir, *parts)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        return full_path
+
+    def subdir(self, *parts):
+        """Create and return a directory inside the scratch directory"""
+        full_path = os.path.join(self.dir, *parts)
+        os.makedirs(full_path, exist_ok=True)
+        return full_path
+
+    def usage(self):
+        """Bytes currently stored in the scratch directory"""
+        total = 0
+        for dirpath, _, filenames in os.walk(self.dir):
+            for filename in filenames:
+                try:
+                    total += os.lstat(os.path.join(dirpath, filename)).st_size
+                except OSError:
+                    continue
+        return total
+
+    def check(self):
+        """Raise ScratchQuotaExceeded if the directory has outgrown its quota"""
+        used = self.usage()
+        if used > self.quota_bytes:
+            raise ScratchQuotaExceeded(f"{self.name} uses {used} bytes of scratch space, quota is {self.quota_bytes}")
+
+    def cleanup(self):
+        if self.dir:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+
+def remove_stale(root, max_age):
+    """Remove scratch directories left behind by processes that died mid-job"""
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(root):
+        try:
+            if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                logger.info(f"Removed stale scratch directory {entry.path}")
+        except OSError:
+            continue
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Long-lived model worker for the preprocessing / try-on scripts.
+
+One worker runs per conda environment (started with that environment's
+python). Each stage script exposes ``build_worker()``, which loads its model
+once and returns a ``handle(argv)`` callable taking the same arguments as the
+script's command line. The orchestrator sends ``{"script", "argv"}`` requests
+over a local socket and gets the script's return code and output back.
+
+Only the standard library is used so the same file runs in every environment.
+"""
+
+import io
+import os
+import sys
+import argparse
+import logging
+import threading
+import traceback
+import importlib.util
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+logger = logging.getLogger("model_worker")
+
+# Requests are pickled, so the shared secret is all that stands between the
+# port and arbitrary code execution: there is deliberately no default
+AUTHKEY = os.getenv("MODEL_WORKER_AUTHKEY", "").encode() or None
+
+# Characters of a request's stdout/stderr sent back (the tail is kept)
+MAX_CAPTURED_OUTPUT = 64 * 1024
+
+
+class WorkerUnavailable(Exception):
+    """The worker could not be reached or dropped the connection"""
+
+
+class ThreadOutput:
+    """Stand-in for sys.stdout/sys.stderr that captures a request's writes.
+
+    Requests for different scripts run in parallel threads, so output is
+    captured per thread; writes from other threads go to the real stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def capture(self):
+        self.local.buffer = io.StringIO()
+
+    def release(self):
+        """Stop capturing and return the tail of what was written"""
+        buffer = getattr(self.local, "buffer", None)
+        self.local.buffer = None
+        return buffer.getvalue()[-MAX_CAPTURED_OUTPUT:] if buffer else ""
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def request_worker(address, script_path, argv, timeout=300, authkey=AUTHKEY):
+    """Run a stage script on a warm worker.
+
+    Returns (returncode, stdout, stderr) of the script.
+
+    Raises WorkerUnavailable if the worker is down or dies mid-request, so the
+    caller can fall back to a fresh subprocess (also when no authkey is
+    configured). Raises TimeoutError if the script has not finished
+    ``timeout`` seconds after the worker started it; the worker restarts
+    itself at that point too. Time spent queued behind other requests for
+    the same script does not count: a queued request is only abandoned when
+    the worker dies, never while it is still going to run.
+    """
+    if not authkey:
+        raise WorkerUnavailable("MODEL_WORKER_AUTHKEY is not set")
+    try:
+        conn = Client(address, authkey=authkey)
+    except (OSError, EOFError, AuthenticationError) as e:
+        raise WorkerUnavailable(f"Worker at {address} unavailable: {e}")
+
+    try:
+        conn.send({"op": "run", "script": script_path, "argv": list(argv), "timeout": timeout})
+        # Blocks while the request waits for the script's lock
+        reply = conn.recv()
+        if reply.get("started"):
+            if not conn.poll(timeout):
+                raise TimeoutError(f"Worker at {address} did not answer after {timeout} seconds")
+            reply = conn.recv()
+    except TimeoutError:
+        # A subclass of OSError, but the worker is alive, only stuck
+        raise
+    except (OSError, EOFError) as e:
+        raise WorkerUnavailable(f"Worker at {address} dropped the request: {e}")
+    finally:
+        conn.close()
+
+    if reply.get("error"):
+        logger.error(f"Worker error for {script_path}: {reply['error']}")
+    return reply.get("returncode", 1), reply.get("stdout", ""), reply.get("stderr", "")
+
+
+class ModelWorker:
+    """Serves stage requests, loading each script's model on first use"""
+
+    def __init__(self, address, authkey=AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self.handlers = {}
+        self.locks = {}
+        self.load_lock = threading.Lock()
+        # The worker's own log handlers keep the original streams
+        self.stdout = sys.stdout = ThreadOutput(sys.stdout)
+        self.stderr = sys.stderr = ThreadOutput(sys.stderr)
+
+    def load(self, script_path):
+        """Import a stage script and build its warm handler (once)"""
+        script_path = os.path.abspath(script_path)
+        with self.load_lock:
+            if script_path in self.handlers:
+                return self.handlers[script_path], self.locks[script_path]
+
+            script_dir = os.path.dirname(script_path)
+            if script_dir not in sys.path:
+                sys.path.insert(0, script_dir)
+
+            module_name = "stage_" + os.path.splitext(os.path.basename(script_path))[0]
+            spec = importlib.util.spec_from_file_location(module_name, script_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+
+            logger.info(f"Loading model for {script_path}")
+            self.handlers[script_path] = module.build_worker()
+            # Models are not assumed to be thread-safe: one request per script at a time
+            self.locks[script_path] = threading.Lock()
+            return self.handlers[script_path], self.locks[script_path]
+
+    def run(self, script_path, argv, timeout=None, started=None):
+        """Run a request and return (returncode, stdout, stderr).
+
+        started() is called once the request holds the script's lock.
+        """
+        handle, lock = self.load(script_path)
+        with lock:
+            if started:
+                started()
+            watchdog = None
+            if timeout:
+                watchdog = threading.Timer(timeout, self.restart, args=(script_path, timeout))
+                watchdog.daemon = True
+                watchdog.start()
+            self.stdout.capture()
+            self.stderr.capture()
+            try:
+                returncode = handle(argv)
+            except SystemExit as e:
+                returncode = e.code if isinstance(e.code, int) else 1
+            finally:
+                stdout, stderr = self.stdout.release(), self.stderr.release()
+                if watchdog:
+                    watchdog.cancel()
+        return returncode or 0, stdout, stderr
+
+    def restart(self, script_path, timeout):
+        """Replace the worker process with a fresh one.
+
+        A hung handler cannot be interrupted from another thread and keeps its
+        script's lock, so every later request would queue behind it. Clients
+        of requests still in flight see the connection drop and fall back to
+        a subprocess.
+        """
+        logger.error(f"{script_path} ran longer than {timeout} seconds, restarting worker")
+        logging.shutdown()
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def serve_connection(self, conn):
+        try:
+            request = conn.recv()
+            try:
+                returncode, stdout, stderr = self.run(request["script"], request.get("argv", []),
+                                                      request.get("timeout"),
+                                                      started=lambda: conn.send({"started": True}))
+                conn.send({"returncode": returncode, "stdout": stdout, "stderr": stderr})
+            except Exception:
+                logger.error(f"Request for {request.get('script')} failed", exc_info=True)
+                conn.send({"returncode": 1, "error": traceback.format_exc()})
+        except (OSError, EOFError) as e:
+            logger.warning(f"Connection dropped: {e}")
+        finally:
+            conn.close()
+
+    def serve_forever(self, preload=None):
+        for script_path in preload or []:
+            self.load(script_path)
+
+        with Listener(self.address, authkey=self.authkey) as listener:
+            logger.info(f"Model worker listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning(f"Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self.serve_connection, args=(conn,), daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm model worker for one conda environment")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, required=True, help="Port to listen on")
+    parser.add_argument("--preload", nargs="*", default=[], help="Stage scripts to load at startup")
+
+    args = parser.parse_args()
+    if not AUTHKEY:
+        parser.error("MODEL_WORKER_AUTHKEY must be set (shared with the orchestrator)")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    ModelWorker((args.host, args.port)).serve_forever(args.preload)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        logger.info("Model worker stopped by user")
@@ -0,0 +1,41 @@
+"""Stage graph and versions of the try-on pipeline.
+
+Shared by the orchestrator, which keys the artifact cache on stage versions,
+and the Flask app, which only reuses a completed result if it was produced
+by the current PIPELINE_VERSION.
+"""
+
+import hashlib
+
+# Stage dependency graph for process_job: each stage lists the stages it needs.
+# cloth_mask only needs the cloth image; segmentation and OpenPose only need
+# person_nobg, so those branches run side by side.
+STAGE_DEPENDENCIES = {
+    "remove_bg": [],
+    "cloth_mask": [],
+    "segmentation": ["remove_bg"],
+    "pose_generation": ["remove_bg"],
+    "final_processing": ["cloth_mask", "segmentation", "pose_generation"]
+}
+
+# Bump a stage's version whenever its script or model changes; cached outputs
+# of that stage and of every stage depending on it are then ignored.
+STAGE_VERSIONS = {
+    "remove_bg": "1",
+    "cloth_mask": "1",
+    "segmentation": "1",
+    "pose_generation": "1",
+    "final_processing": "1"
+}
+
+
+def stage_version(step):
+    """Version string of a stage including every stage it depends on"""
+    versions = [f"{step}:{STAGE_VERSIONS[step]}"]
+    for dep in STAGE_DEPENDENCIES.get(step, []):
+        versions.append(stage_version(dep))
+    return ";".join(sorted(versions))
+
+
+# Version of the whole pipeline; changes whenever any stage version changes
+PIPELINE_VERSION = hashlib.sha256(stage_version("final_processing").encode()).hexdigest()[:16]
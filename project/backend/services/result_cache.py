@@ -0,0 +1,162 @@
+"""Two-level LRU cache of completed try-on results, keyed by job id.
+
+Results never change once a job is completed, so their bytes can be served
+without a database lookup or S3 GET. Recently used results are kept in
+memory; every cached result is also kept on disk as
+
+    <root>/<job_id>.jpg
+
+so the cache survives restarts and can be pre-seeded by the orchestrator
+(a separate process) as soon as it writes the result. Both levels are
+bounded by a byte budget; the least recently used results (for the disk
+level, by file mtime, refreshed on every hit) are evicted first.
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger("result_cache")
+
+
+class ResultCache:
+    """Memory + disk LRU cache of result images with hit-rate counters"""
+
+    def __init__(self, root, max_bytes, memory_max_bytes=0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, job_id):
+        return os.path.join(self.root, f"{int(job_id)}.jpg")
+
+    def _remember(self, job_id, data, etag):
+        """Keep a result in memory, evicting least recently used ones"""
+        if len(data) > self.memory_max_bytes:
+            return
+        with self.lock:
+            if job_id in self.memory:
+                return
+            self.memory[job_id] = (data, etag)
+            self.memory_bytes += len(data)
+            while self.memory_bytes > self.memory_max_bytes:
+                _, (evicted, _) = self.memory.popitem(last=False)
+                self.memory_bytes -= len(evicted)
+
+    def get(self, job_id):
+        """Return (bytes, etag) of a cached result, or None on a miss"""
+        with self.lock:
+            if job_id in self.memory:
+                self.memory.move_to_end(job_id)
+                self.memory_hits += 1
+                return self.memory[job_id]
+
+        path = self.path(job_id)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        self._remember(job_id, data, etag)
+        with self.lock:
+            self.disk_hits += 1
+        return data, etag
+
+    def put_file(self, job_id, src):
+        """Copy a result file into the cache, then evict"""
+        dest = self.path(job_id)
+        staging = f"{dest}.tmp-{uuid.uuid4().hex[:8]}"
+        try:
+            shutil.copyfile(src, staging)
+            os.replace(staging, dest)
+        except OSError as e:
+            logger.warning(f"Could not cache result of job {job_id}: {str(e)}")
+            if os.path.exists(staging):
+                os.remove(staging)
+            return False
+
+        self.evict()
+        return True
+
+    def tee(self, job_id, chunks):
+        """Yield chunks unchanged while caching them; the result is only
+        cached if the whole stream is consumed"""
+        dest = self.path(job_id)
+        staging = f"{dest}.tmp-{uuid.uuid4().hex[:8]}"
+        try:
+            f = open(staging, 'wb')
+        except OSError as e:
+            logger.warning(f"Could not cache result of job {job_id}: {str(e)}")
+            yield from chunks
+            return
+
+        complete = False
+        try:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+            complete = True
+        finally:
+            f.close()
+            try:
+                if complete:
+                    os.replace(staging, dest)
+                else:
+                    os.remove(staging)
+            except OSError as e:
+                logger.warning(f"Could not cache result of job {job_id}: {str(e)}")
+        if complete:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used files until the disk level fits max_bytes"""
+        try:
+            entries = sorted(
+                (e.stat().st_mtime, e.stat().st_size, e.path)
+                for e in os.scandir(self.root)
+                if e.is_file() and ".tmp-" not in e.name
+            )
+        except OSError as e:
+            logger.warning(f"Could not scan result cache: {str(e)}")
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            logger.info(f"Evicted cached result {path}")
+
+    def stats(self):
+        """Hit/miss counters and memory usage"""
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+                "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,106 @@
+import json
+import time
+import queue
+import select
+import logging
+import threading
+
+import psycopg2
+
+logger = logging.getLogger("status_stream")
+
+
+class StatusBroadcaster:
+    """Fans job status notifications out to any number of subscribers.
+
+    A single connection LISTENs on the status channel. The orchestrator sends
+    the job id with pg_notify whenever a job or one of its steps changes
+    status; the broadcaster then loads that job's status once (load_status)
+    and puts it on the queue of every subscriber watching the job. Once the
+    job no longer exists None is put instead, and subscribers should stop.
+    """
+
+    def __init__(self, db_params, channel, load_status, reconnect_delay=5):
+        self.db_params = db_params
+        self.channel = channel
+        self.load_status = load_status
+        self.reconnect_delay = reconnect_delay
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._listen_forever, name="status-listener", daemon=True)
+                self.thread.start()
+
+    def subscribe(self, job_id):
+        """Return a queue receiving every status update of job_id"""
+        self.start()
+        q = queue.Queue()
+        with self.lock:
+            self.subscribers.setdefault(job_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, job_id, q):
+        with self.lock:
+            watchers = self.subscribers.get(job_id)
+            if watchers:
+                watchers.discard(q)
+                if not watchers:
+                    del self.subscribers[job_id]
+
+    def _publish(self, job_id):
+        with self.lock:
+            watchers = list(self.subscribers.get(job_id, ()))
+        if not watchers:
+            return
+        try:
+            status = self.load_status(job_id)
+        except Exception as e:
+            logger.error(f"Could not load status of job {job_id}: {e}")
+            return
+        for q in watchers:
+            q.put(status)
+
+    def _listen_forever(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_params)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                logger.info(f"Listening for status changes on '{self.channel}'")
+
+                # Resync watchers in case updates were missed while disconnected
+                with self.lock:
+                    watched = list(self.subscribers)
+                for job_id in watched:
+                    self._publish(job_id)
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    job_ids = set()
+                    while conn.notifies:
+                        job_ids.add(conn.notifies.pop(0).payload)
+                    for payload in job_ids:
+                        try:
+                            self._publish(int(payload))
+                        except ValueError:
+                            logger.warning(f"Ignoring status notification {payload!r}")
+            except Exception as e:
+                logger.error(f"Status listener failed, reconnecting: {e}")
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(self.reconnect_delay)
+
+
+def format_event(data, event=None):
+    """Encode one Server-Sent Events message"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
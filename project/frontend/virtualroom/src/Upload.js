@@ -14,6 +14,7 @@ export default function Upload() {
   const [processingStatus, setProcessingStatus] = useState(null);
   const [statusCheckInterval, setStatusCheckInterval] = useState(null);
   const [resultImageUrl, setResultImageUrl] = useState(null);
+  const statusSourceRef = useRef(null);
 
   // Function to check job status
   const checkJobStatus = (id) => {
@@ -46,24 +47,6 @@ export default function Upload() {
       });
   };
 
-  // Clean up old datasets when a result is displayed
-  useEffect(() => {
-    if (resultImageUrl && jobId) {
-      // Send a request to clean up old datasets
-      fetch("http://127.0.0.1:5001/cleanup", {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-          job_id: jobId,
-        }),
-      }).catch((error) => {
-        console.error("Error cleaning up datasets:", error);
-      });
-    }
-  }, [resultImageUrl, jobId]);
-
   // Clear interval when component unmounts
   useEffect(() => {
     return () => {
@@ -73,6 +56,55 @@ export default function Upload() {
     };
   }, [statusCheckInterval]);
 
+  // Close the status stream when component unmounts
+  useEffect(() => {
+    return () => {
+      if (statusSourceRef.current) {
+        statusSourceRef.current.close();
+      }
+    };
+  }, []);
+
+  // Follow job status over Server-Sent Events, falling back to polling
+  const watchJobStatus = (id) => {
+    if (statusSourceRef.current) {
+      statusSourceRef.current.close();
+    }
+
+    const source = new EventSource(`http://127.0.0.1:5001/status/${id}/stream`);
+    statusSourceRef.current = source;
+
+    source.addEventListener("status", (event) => {
+      const data = JSON.parse(event.data);
+      setProcessingStatus(data);
+
+      if (data.result_url) {
+        setResultImageUrl(data.result_url);
+      }
+
+      // The server ends the stream once the job is done
+      if (data.overall_status === "completed" || data.overall_status === "failed") {
+        source.close();
+      }
+    });
+
+    // The job was deleted while being watched
+    source.addEventListener("not_found", () => {
+      source.close();
+      console.error(`Job ${id} no longer exists`);
+    });
+
+    source.onerror = () => {
+      source.close();
+      console.error("Status stream unavailable, polling instead");
+
+      // Check status every 5 seconds
+      const intervalId = setInterval(() => checkJobStatus(id), 5000);
+      setStatusCheckInterval(intervalId);
+      checkJobStatus(id);
+    };
+  };
+
   const handleFileChange1 = (e) => {
     const file = e.target.files[0];
     if (file) {
@@ -157,12 +189,8 @@ export default function Upload() {
         setGenerationStatus(`Generation request submitted successfully! Job ID: ${data.job_id}`);
         console.log("Generation Success:", data);
         
-        // Start checking status every 5 seconds
-        const intervalId = setInterval(() => checkJobStatus(data.job_id), 5000);
-        setStatusCheckInterval(intervalId);
-        
-        // Initial status check
-        checkJobStatus(data.job_id);
+        // Stream status updates as the job progresses
+        watchJobStatus(data.job_id);
       })
       .catch((error) => {
         setGenerationStatus("Error submitting generation request");
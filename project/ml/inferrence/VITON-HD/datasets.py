@@ -8,6 +8,14 @@ from torch.utils import data
 from torchvision import transforms
 
 
+def open_image(path):
+    """Open an image, preferring a decoded .npy copy saved next to it"""
+    npy_path = osp.splitext(path)[0] + '.npy'
+    if osp.exists(npy_path):
+        return Image.fromarray(np.asarray(np.load(npy_path, mmap_mode='r')))
+    return Image.open(path)
+
+
 class VITONDataset(data.Dataset):
     def __init__(self, opt):
         super(VITONDataset, self).__init__()
@@ -124,7 +132,7 @@ class VITONDataset(data.Dataset):
             c_name[key] = self.c_names[key][index]
             c[key] = Image.open(osp.join(self.data_path, 'cloth', c_name[key])).convert('RGB')
             c[key] = transforms.Resize(self.load_width, interpolation=2)(c[key])
-            cm[key] = Image.open(osp.join(self.data_path, 'cloth-mask', c_name[key]))
+            cm[key] = open_image(osp.join(self.data_path, 'cloth-mask', c_name[key]))
             cm[key] = transforms.Resize(self.load_width, interpolation=0)(cm[key])
 
             c[key] = self.transform(c[key])  # [-1,1]
@@ -135,7 +143,7 @@ class VITONDataset(data.Dataset):
 
         # load pose image
         pose_name = img_name.replace('.jpg', '_rendered.png')
-        pose_rgb = Image.open(osp.join(self.data_path, 'openpose-img', pose_name))
+        pose_rgb = open_image(osp.join(self.data_path, 'openpose-img', pose_name))
         pose_rgb = transforms.Resize(self.load_width, interpolation=2)(pose_rgb)
         pose_rgb = self.transform(pose_rgb)  # [-1,1]
 
@@ -148,7 +156,7 @@ class VITONDataset(data.Dataset):
 
         # load parsing image
         parse_name = img_name.replace('.jpg', '.png')
-        parse = Image.open(osp.join(self.data_path, 'image-parse', parse_name))
+        parse = open_image(osp.join(self.data_path, 'image-parse', parse_name))
         parse = transforms.Resize(self.load_width, interpolation=0)(parse)
         parse_agnostic = self.get_parse_agnostic(parse, pose_data)
         parse_agnostic = torch.from_numpy(np.array(parse_agnostic)[None]).long()
@@ -176,7 +184,7 @@ class VITONDataset(data.Dataset):
                 new_parse_agnostic_map[i] += parse_agnostic_map[label]
 
         # load person image
-        img = Image.open(osp.join(self.data_path, 'image', img_name))
+        img = open_image(osp.join(self.data_path, 'image', img_name))
         img = transforms.Resize(self.load_width, interpolation=2)(img)
         img_agnostic = self.get_img_agnostic(img, parse, pose_data)
         img = self.transform(img)
@@ -11,7 +11,7 @@ from networks import SegGenerator, GMM, ALIASGenerator
 from utils import gen_noise, load_checkpoint, save_images
 
 
-def get_opt():
+def get_opt(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--name', type=str, required=True)
 
@@ -48,7 +48,7 @@ def get_opt():
                         help='If \'more\', add upsampling layer between the two middle resnet blocks. '
                              'If \'most\', also add one more (upsampling + resnet) layer at the end of the generator.')
 
-    opt = parser.parse_args()
+    opt = parser.parse_args(argv)
     return opt
 
 
@@ -128,13 +128,7 @@ def test(opt, seg, gmm, alias):
                 print("step: {}".format(i + 1))
 
 
-def main():
-    opt = get_opt()
-    print(opt)
-
-    if not os.path.exists(os.path.join(opt.save_dir, opt.name)):
-        os.makedirs(os.path.join(opt.save_dir, opt.name))
-
+def load_models(opt):
     seg = SegGenerator(opt, input_nc=opt.semantic_nc + 8, output_nc=opt.semantic_nc)
     gmm = GMM(opt, inputA_nc=7, inputB_nc=3)
     opt.semantic_nc = 7
@@ -148,6 +142,41 @@ def main():
     seg.cuda().eval()
     gmm.cuda().eval()
     alias.cuda().eval()
+    return seg, gmm, alias
+
+
+def build_worker():
+    """Keep loaded networks across requests for model_worker.py.
+
+    Networks are cached per architecture/checkpoint options; the dataset and
+    output options of each request are free to change.
+    """
+    models = {}
+
+    def handle(argv):
+        opt = get_opt(argv)
+        key = (opt.checkpoint_dir, opt.seg_checkpoint, opt.gmm_checkpoint, opt.alias_checkpoint,
+               opt.load_height, opt.load_width, opt.semantic_nc, opt.grid_size, opt.norm_G,
+               opt.ngf, opt.num_upsampling_layers)
+        if key not in models:
+            models[key] = load_models(opt)
+
+        if not os.path.exists(os.path.join(opt.save_dir, opt.name)):
+            os.makedirs(os.path.join(opt.save_dir, opt.name))
+        test(opt, *models[key])
+        return 0
+
+    return handle
+
+
+def main():
+    opt = get_opt()
+    print(opt)
+
+    if not os.path.exists(os.path.join(opt.save_dir, opt.name)):
+        os.makedirs(os.path.join(opt.save_dir, opt.name))
+
+    seg, gmm, alias = load_models(opt)
     test(opt, seg, gmm, alias)
 
 
@@ -7,25 +7,18 @@ import json
 import argparse
 from sys import platform
 
-def main():
-    # Parse command line arguments
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Process an image with OpenPose")
     parser.add_argument("--input", required=True, help="Path to input image")
     parser.add_argument("--output", required=True, help="Path to save output visualization")
     parser.add_argument("--json-output", help="Path to save JSON keypoints")
+    parser.add_argument("--npy-input", help="Decoded RGB input (.npy) to use instead of reading --input")
+    parser.add_argument("--npy-output", help="Also save the pose image as RGB .npy")
 
-    args = parser.parse_args()
-
-    input_path = args.input
-    output_path = args.output
-    json_output_path = args.json_output
+    return parser.parse_args(argv)
 
-    print(f"Processing: {input_path}")
-    print(f"Output image: {output_path}")
-    if json_output_path:
-        print(f"Output JSON: {json_output_path}")
-
-    # Import OpenPose
+def import_openpose():
+    """Import pyopenpose from the OpenPose build"""
     dir_path = os.path.dirname(os.path.realpath(__file__))
     try:
         if platform == "win32":
@@ -38,12 +31,10 @@ def main():
     except ImportError as e:
         print('Error: OpenPose library could not be found. Did you enable `BUILD_PYTHON` in CMake and have this Python script in the right folder?')
         sys.exit(1)
+    return op
 
-    # Create output directories
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    if json_output_path:
-        os.makedirs(os.path.dirname(json_output_path), exist_ok=True)
-
+def start_wrapper(op):
+    """Configure and start the OpenPose wrapper (loads the BODY_25 model)"""
     # Set up OpenPose parameters for black background
     params = {
         "model_folder": "C:/Users/singh/Downloads/openpose-1.7.0-binaries-win64-gpu-python3.7-flir-3d_recommended/openpose/models/",
@@ -56,16 +47,31 @@ def main():
         "number_people_max": 1
     }
 
-    # Initialize OpenPose
     op_wrapper = op.WrapperPython()
     op_wrapper.configure(params)
     op_wrapper.start()
+    return op_wrapper
 
-    # Process the image
-    image_to_process = cv2.imread(input_path)
+def process(op, op_wrapper, input_path, output_path, json_output_path=None, npy_input=None, npy_output=None):
+    """Run pose estimation on one image with an already started wrapper"""
+    print(f"Processing: {input_path}")
+    print(f"Output image: {output_path}")
+    if json_output_path:
+        print(f"Output JSON: {json_output_path}")
+
+    # Create output directories
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if json_output_path:
+        os.makedirs(os.path.dirname(json_output_path), exist_ok=True)
+
+    # Process the image, memory-mapping the decoded array when one was handed over
+    if npy_input and os.path.exists(npy_input):
+        image_to_process = np.ascontiguousarray(np.load(npy_input, mmap_mode='r')[:, :, ::-1])
+    else:
+        image_to_process = cv2.imread(input_path)
     if image_to_process is None:
         print(f"Error loading image: {input_path}")
-        sys.exit(1)
+        return 1
 
     datum = op.Datum()
     datum.cvInputData = image_to_process
@@ -82,11 +88,15 @@ def main():
         result = cv2.bitwise_and(datum.cvOutputData, black_bg)
         cv2.imwrite(output_path, result)
         print(f"Saved pose image with black background: {output_path}")
+        if npy_output:
+            np.save(npy_output, result[:, :, ::-1])
     else:
         print("Warning: No output data generated from OpenPose")
         # Create blank black image as fallback
         blank_image = np.zeros((image_to_process.shape[0], image_to_process.shape[1], 3), dtype=np.uint8)
         cv2.imwrite(output_path, blank_image)
+        if npy_output:
+            np.save(npy_output, blank_image)
 
     # Save JSON if requested
     if json_output_path:
@@ -110,5 +120,26 @@ def main():
     print("Processing complete!")
     return 0
 
+def build_worker():
+    """Start OpenPose once and return a handler for model_worker.py"""
+    op = import_openpose()
+    op_wrapper = start_wrapper(op)
+
+    def handle(argv):
+        args = parse_args(argv)
+        return process(op, op_wrapper, args.input, args.output, args.json_output, args.npy_input, args.npy_output)
+
+    return handle
+
+def main():
+    # Parse command line arguments
+    args = parse_args()
+
+    # Import and initialize OpenPose
+    op = import_openpose()
+    op_wrapper = start_wrapper(op)
+
+    return process(op, op_wrapper, args.input, args.output, args.json_output, args.npy_input, args.npy_output)
+
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
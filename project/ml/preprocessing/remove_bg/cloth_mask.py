@@ -4,7 +4,7 @@ import numpy as np
 import argparse
 import os
 
-def create_cloth_mask(input_path, mask_output_path, masked_output_path=None):
+def create_cloth_mask(input_path, mask_output_path, masked_output_path=None, npy_output=None):
     # Load the image
     image = cv2.imread(input_path)
     if image is None:
@@ -24,6 +24,10 @@ def create_cloth_mask(input_path, mask_output_path, masked_output_path=None):
     # Save the mask
     cv2.imwrite(mask_output_path, mask)
     print(f"Mask saved to {mask_output_path}")
+
+    # Lossless copy of the mask (the JPEG above is lossy)
+    if npy_output:
+        np.save(npy_output, mask)
     
     # If masked output path is provided, create the masked image
     if masked_output_path:
@@ -34,15 +38,27 @@ def create_cloth_mask(input_path, mask_output_path, masked_output_path=None):
     
     return True
 
-if __name__ == "__main__":
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Create a mask for cloth images")
     parser.add_argument("--input", required=True, help="Path to input cloth image")
     parser.add_argument("--output", required=True, help="Path to save output mask")
     parser.add_argument("--masked-output", help="Optional path to save masked cloth image")
+    parser.add_argument("--npy-output", help="Optional path to save the mask as .npy")
     
-    args = parser.parse_args()
+    return parser.parse_args(argv)
+
+def build_worker():
+    """Return a handler for model_worker.py (no model to load, only imports)"""
+    def handle(argv):
+        args = parse_args(argv)
+        return 0 if create_cloth_mask(args.input, args.output, args.masked_output, args.npy_output) else 1
+
+    return handle
+
+if __name__ == "__main__":
+    args = parse_args()
     
-    success = create_cloth_mask(args.input, args.output, args.masked_output)
+    success = create_cloth_mask(args.input, args.output, args.masked_output, args.npy_output)
     
     if success:
         print("Cloth mask creation completed successfully")
@@ -3,10 +3,11 @@ import argparse
 import io
 import os
 import sys
+import numpy as np
 from PIL import Image
-from rembg import remove
+from rembg import new_session, remove
 
-def process_image(input_path, output_path):
+def process_image(input_path, output_path, session=None, npy_output=None):
     """Process image by removing background and standardizing size"""
     try:
         # Create output directory if it doesn't exist
@@ -17,7 +18,7 @@ def process_image(input_path, output_path):
             input_image = f.read()
         
         # Remove background
-        output_image = remove(input_image)
+        output_image = remove(input_image, session=session)
         
         # Convert to PIL Image for processing
         img = Image.open(io.BytesIO(output_image))
@@ -59,20 +60,38 @@ def process_image(input_path, output_path):
         
         # Save the result
         canvas.save(output_path)
+
+        # Lossless decoded copy for the next stages to memory-map
+        if npy_output:
+            np.save(npy_output, np.asarray(canvas))
         return True
         
     except Exception as e:
         print(f"Error processing image: {str(e)}", file=sys.stderr)
         return False
 
-if __name__ == "__main__":
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         description="Remove background from image and standardize size"
     )
     parser.add_argument("--input", required=True, help="Input image path")
     parser.add_argument("--output", required=True, help="Output image path")
+    parser.add_argument("--npy-output", help="Also save the decoded RGB result as .npy")
     
-    args = parser.parse_args()
+    return parser.parse_args(argv)
+
+def build_worker():
+    """Load the rembg model once and return a handler for model_worker.py"""
+    session = new_session()
+
+    def handle(argv):
+        args = parse_args(argv)
+        return 0 if process_image(args.input, args.output, session, args.npy_output) else 1
+
+    return handle
+
+if __name__ == "__main__":
+    args = parse_args()
     
-    success = process_image(args.input, args.output)
+    success = process_image(args.input, args.output, npy_output=args.npy_output)
     sys.exit(0 if success else 1)
\ No newline at end of file
@@ -18,8 +18,10 @@ from utils.image_reade_inf import *
 from utils.ops import  *
 from utils.utils import *
 from utils.model_pgn import *
+# utils.utils also defines IMG_MEAN; the reader's mean is the one the input needs
+from utils.image_reade_inf import IMG_MEAN as READER_IMG_MEAN
 
-def parse_args():
+def parse_args(argv=None):
     """Parse command line arguments"""
     argp = argparse.ArgumentParser(description="Inference pipeline")
     argp.add_argument('--input', required=True, help='Path to the input image')
@@ -30,17 +32,12 @@ def parse_args():
                      default='./val_id.txt')
     argp.add_argument('--val-file', type=str, help='Path to val.txt file',
                      default='./val.txt')
-    return argp.parse_args()
+    argp.add_argument('--npy-input', help='Decoded RGB input (.npy) to use instead of decoding --input')
+    argp.add_argument('--npy-output', help='Also save the label map as .npy')
+    return argp.parse_args(argv)
 
-def main():
-    """Create the model and start the evaluation process."""
-    args = parse_args()
-    
-    # Validate input file exists
-    if not os.path.exists(args.input):
-        print(f"Error: Input image '{args.input}' does not exist!")
-        return 1
-    
+def ensure_val_files(args):
+    """Create default val_id.txt / val.txt for the input image if missing"""
     # Check val files
     if not os.path.exists(args.val_id_file):
         print(f"Warning: Val ID file '{args.val_id_file}' does not exist!")
@@ -69,193 +66,251 @@ def main():
         except Exception as e:
             print(f"Error creating val.txt: {e}")
             return 1
-    
-    # Make sure output directory exists
-    output_dir = os.path.dirname(args.output)
-    parsing_dir = os.path.join(output_dir, 'cihp_parsing_maps')
-    edge_dir = os.path.join(output_dir, 'cihp_edge_maps')
-    
-    os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(parsing_dir, exist_ok=True)
-    os.makedirs(edge_dir, exist_ok=True)
-    
-    # Create a single-element image list
-    image_list_inp = [args.input]
-    
-    # Constants
+    return 0
+
+class PGNInference(object):
+    """CIHP_PGN multi-scale parsing graph, built and restored once.
+
+    The input image path is fed through a placeholder so the same session can
+    parse any number of images without rebuilding the graph. An already
+    decoded image can be fed to self.image instead, which skips reading and
+    decoding the file.
+    """
+
     N_CLASSES = 20
-    NUM_STEPS = 1  # We're only processing one image
-    RESTORE_FROM = args.checkpoint
-    
-    # Check if checkpoint directory exists
-    print(f"Checkpoint directory: {RESTORE_FROM}")
-    print(f"Checkpoint exists: {os.path.exists(RESTORE_FROM)}")
-    
-    # Create queue coordinator
-    coord = tf.train.Coordinator()
-    
-    # Load reader
-    with tf.name_scope("create_inputs"):
-        reader = ImageReader(image_list_inp, None, False, False, False, coord)
-        image = reader.image
-        image_rev = tf.reverse(image, tf.stack([1]))
-    
-    image_batch = tf.stack([image, image_rev])
-    h_orig, w_orig = tf.to_float(tf.shape(image_batch)[1]), tf.to_float(tf.shape(image_batch)[2])
-    image_batch050 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 0.50)), tf.to_int32(tf.multiply(w_orig, 0.50))]))
-    image_batch075 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 0.75)), tf.to_int32(tf.multiply(w_orig, 0.75))]))
-    image_batch125 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 1.25)), tf.to_int32(tf.multiply(w_orig, 1.25))]))
-    image_batch150 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 1.50)), tf.to_int32(tf.multiply(w_orig, 1.50))]))
-    image_batch175 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 1.75)), tf.to_int32(tf.multiply(w_orig, 1.75))]))
+
+    def __init__(self, checkpoint):
+        N_CLASSES = self.N_CLASSES
+        RESTORE_FROM = checkpoint
+
+        # Check if checkpoint directory exists
+        print(f"Checkpoint directory: {RESTORE_FROM}")
+        print(f"Checkpoint exists: {os.path.exists(RESTORE_FROM)}")
+
+        # Load reader
+        self.image_path = tf.placeholder(tf.string, shape=[])
+        with tf.name_scope("create_inputs"):
+            image = read_images_from_disk([self.image_path], None, False, False)
+            self.image = tf.placeholder_with_default(image, shape=[None, None, 3])
+            image = self.image
+            image_rev = tf.reverse(image, tf.stack([1]))
+
+        image_batch = tf.stack([image, image_rev])
+        h_orig, w_orig = tf.to_float(tf.shape(image_batch)[1]), tf.to_float(tf.shape(image_batch)[2])
+        image_batch050 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 0.50)), tf.to_int32(tf.multiply(w_orig, 0.50))]))
+        image_batch075 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 0.75)), tf.to_int32(tf.multiply(w_orig, 0.75))]))
+        image_batch125 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 1.25)), tf.to_int32(tf.multiply(w_orig, 1.25))]))
+        image_batch150 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 1.50)), tf.to_int32(tf.multiply(w_orig, 1.50))]))
+        image_batch175 = tf.image.resize_images(image_batch, tf.stack([tf.to_int32(tf.multiply(h_orig, 1.75)), tf.to_int32(tf.multiply(w_orig, 1.75))]))
          
-    # Create network.
-    with tf.variable_scope('', reuse=False):
-        net_100 = PGNModel({'data': image_batch}, is_training=False, n_classes=N_CLASSES)
-    with tf.variable_scope('', reuse=True):
-        net_050 = PGNModel({'data': image_batch050}, is_training=False, n_classes=N_CLASSES)
-    with tf.variable_scope('', reuse=True):
-        net_075 = PGNModel({'data': image_batch075}, is_training=False, n_classes=N_CLASSES)
-    with tf.variable_scope('', reuse=True):
-        net_125 = PGNModel({'data': image_batch125}, is_training=False, n_classes=N_CLASSES)
-    with tf.variable_scope('', reuse=True):
-        net_150 = PGNModel({'data': image_batch150}, is_training=False, n_classes=N_CLASSES)
-    with tf.variable_scope('', reuse=True):
-        net_175 = PGNModel({'data': image_batch175}, is_training=False, n_classes=N_CLASSES)
+        # Create network.
+        with tf.variable_scope('', reuse=False):
+            net_100 = PGNModel({'data': image_batch}, is_training=False, n_classes=N_CLASSES)
+        with tf.variable_scope('', reuse=True):
+            net_050 = PGNModel({'data': image_batch050}, is_training=False, n_classes=N_CLASSES)
+        with tf.variable_scope('', reuse=True):
+            net_075 = PGNModel({'data': image_batch075}, is_training=False, n_classes=N_CLASSES)
+        with tf.variable_scope('', reuse=True):
+            net_125 = PGNModel({'data': image_batch125}, is_training=False, n_classes=N_CLASSES)
+        with tf.variable_scope('', reuse=True):
+            net_150 = PGNModel({'data': image_batch150}, is_training=False, n_classes=N_CLASSES)
+        with tf.variable_scope('', reuse=True):
+            net_175 = PGNModel({'data': image_batch175}, is_training=False, n_classes=N_CLASSES)
     
-    # parsing net
-    parsing_out1_050 = net_050.layers['parsing_fc']
-    parsing_out1_075 = net_075.layers['parsing_fc']
-    parsing_out1_100 = net_100.layers['parsing_fc']
-    parsing_out1_125 = net_125.layers['parsing_fc']
-    parsing_out1_150 = net_150.layers['parsing_fc']
-    parsing_out1_175 = net_175.layers['parsing_fc']
-
-    parsing_out2_050 = net_050.layers['parsing_rf_fc']
-    parsing_out2_075 = net_075.layers['parsing_rf_fc']
-    parsing_out2_100 = net_100.layers['parsing_rf_fc']
-    parsing_out2_125 = net_125.layers['parsing_rf_fc']
-    parsing_out2_150 = net_150.layers['parsing_rf_fc']
-    parsing_out2_175 = net_175.layers['parsing_rf_fc']
-
-    # edge net
-    edge_out2_100 = net_100.layers['edge_rf_fc']
-    edge_out2_125 = net_125.layers['edge_rf_fc']
-    edge_out2_150 = net_150.layers['edge_rf_fc']
-    edge_out2_175 = net_175.layers['edge_rf_fc']
-
-    # combine resize
-    parsing_out1 = tf.reduce_mean(tf.stack([tf.image.resize_images(parsing_out1_050, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out1_075, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out1_100, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out1_125, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out1_150, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out1_175, tf.shape(image_batch)[1:3,])]), axis=0)
-
-    parsing_out2 = tf.reduce_mean(tf.stack([tf.image.resize_images(parsing_out2_050, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out2_075, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out2_100, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out2_125, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out2_150, tf.shape(image_batch)[1:3,]),
-                                            tf.image.resize_images(parsing_out2_175, tf.shape(image_batch)[1:3,])]), axis=0)
-
-    edge_out2_100 = tf.image.resize_images(edge_out2_100, tf.shape(image_batch)[1:3,])
-    edge_out2_125 = tf.image.resize_images(edge_out2_125, tf.shape(image_batch)[1:3,])
-    edge_out2_150 = tf.image.resize_images(edge_out2_150, tf.shape(image_batch)[1:3,])
-    edge_out2_175 = tf.image.resize_images(edge_out2_175, tf.shape(image_batch)[1:3,])
-    edge_out2 = tf.reduce_mean(tf.stack([edge_out2_100, edge_out2_125, edge_out2_150, edge_out2_175]), axis=0)
+        # parsing net
+        parsing_out1_050 = net_050.layers['parsing_fc']
+        parsing_out1_075 = net_075.layers['parsing_fc']
+        parsing_out1_100 = net_100.layers['parsing_fc']
+        parsing_out1_125 = net_125.layers['parsing_fc']
+        parsing_out1_150 = net_150.layers['parsing_fc']
+        parsing_out1_175 = net_175.layers['parsing_fc']
+
+        parsing_out2_050 = net_050.layers['parsing_rf_fc']
+        parsing_out2_075 = net_075.layers['parsing_rf_fc']
+        parsing_out2_100 = net_100.layers['parsing_rf_fc']
+        parsing_out2_125 = net_125.layers['parsing_rf_fc']
+        parsing_out2_150 = net_150.layers['parsing_rf_fc']
+        parsing_out2_175 = net_175.layers['parsing_rf_fc']
+
+        # edge net
+        edge_out2_100 = net_100.layers['edge_rf_fc']
+        edge_out2_125 = net_125.layers['edge_rf_fc']
+        edge_out2_150 = net_150.layers['edge_rf_fc']
+        edge_out2_175 = net_175.layers['edge_rf_fc']
+
+        # combine resize
+        parsing_out1 = tf.reduce_mean(tf.stack([tf.image.resize_images(parsing_out1_050, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out1_075, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out1_100, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out1_125, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out1_150, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out1_175, tf.shape(image_batch)[1:3,])]), axis=0)
+
+        parsing_out2 = tf.reduce_mean(tf.stack([tf.image.resize_images(parsing_out2_050, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out2_075, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out2_100, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out2_125, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out2_150, tf.shape(image_batch)[1:3,]),
+                                                tf.image.resize_images(parsing_out2_175, tf.shape(image_batch)[1:3,])]), axis=0)
+
+        edge_out2_100 = tf.image.resize_images(edge_out2_100, tf.shape(image_batch)[1:3,])
+        edge_out2_125 = tf.image.resize_images(edge_out2_125, tf.shape(image_batch)[1:3,])
+        edge_out2_150 = tf.image.resize_images(edge_out2_150, tf.shape(image_batch)[1:3,])
+        edge_out2_175 = tf.image.resize_images(edge_out2_175, tf.shape(image_batch)[1:3,])
+        edge_out2 = tf.reduce_mean(tf.stack([edge_out2_100, edge_out2_125, edge_out2_150, edge_out2_175]), axis=0)
                                            
-    raw_output = tf.reduce_mean(tf.stack([parsing_out1, parsing_out2]), axis=0)
-    head_output, tail_output = tf.unstack(raw_output, num=2, axis=0)
-    tail_list = tf.unstack(tail_output, num=20, axis=2)
-    tail_list_rev = [None] * 20
-    for xx in range(14):
-        tail_list_rev[xx] = tail_list[xx]
-    tail_list_rev[14] = tail_list[15]
-    tail_list_rev[15] = tail_list[14]
-    tail_list_rev[16] = tail_list[17]
-    tail_list_rev[17] = tail_list[16]
-    tail_list_rev[18] = tail_list[19]
-    tail_list_rev[19] = tail_list[18]
-    tail_output_rev = tf.stack(tail_list_rev, axis=2)
-    tail_output_rev = tf.reverse(tail_output_rev, tf.stack([1]))
-    
-    raw_output_all = tf.reduce_mean(tf.stack([head_output, tail_output_rev]), axis=0)
-    raw_output_all = tf.expand_dims(raw_output_all, dim=0)
-    pred_scores = tf.reduce_max(raw_output_all, axis=3)
-    raw_output_all = tf.argmax(raw_output_all, axis=3)
-    pred_all = tf.expand_dims(raw_output_all, dim=3) # Create 4-d tensor.
-
-    raw_edge = tf.reduce_mean(tf.stack([edge_out2]), axis=0)
-    head_output, tail_output = tf.unstack(raw_edge, num=2, axis=0)
-    tail_output_rev = tf.reverse(tail_output, tf.stack([1]))
-    raw_edge_all = tf.reduce_mean(tf.stack([head_output, tail_output_rev]), axis=0)
-    raw_edge_all = tf.expand_dims(raw_edge_all, dim=0)
-    pred_edge = tf.sigmoid(raw_edge_all)
-    res_edge = tf.cast(tf.greater(pred_edge, 0.5), tf.int32)
-
-    # Which variables to load.
-    restore_var = tf.global_variables()
+        raw_output = tf.reduce_mean(tf.stack([parsing_out1, parsing_out2]), axis=0)
+        head_output, tail_output = tf.unstack(raw_output, num=2, axis=0)
+        tail_list = tf.unstack(tail_output, num=20, axis=2)
+        tail_list_rev = [None] * 20
+        for xx in range(14):
+            tail_list_rev[xx] = tail_list[xx]
+        tail_list_rev[14] = tail_list[15]
+        tail_list_rev[15] = tail_list[14]
+        tail_list_rev[16] = tail_list[17]
+        tail_list_rev[17] = tail_list[16]
+        tail_list_rev[18] = tail_list[19]
+        tail_list_rev[19] = tail_list[18]
+        tail_output_rev = tf.stack(tail_list_rev, axis=2)
+        tail_output_rev = tf.reverse(tail_output_rev, tf.stack([1]))
     
-    # Set up tf session and initialize variables. 
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True
-    sess = tf.Session(config=config)
-    init = tf.global_variables_initializer()
-    
-    sess.run(init)
-    sess.run(tf.local_variables_initializer())
-    
-    # Load weights.
-    loader = tf.compat.v1.train.Saver(var_list=restore_var)
-    if RESTORE_FROM is not None:
-        if load(loader, sess, RESTORE_FROM):
-            print(" [*] Load SUCCESS")
-        else:
-            print(" [!] Load failed...")
-    
-    # Start queue threads.
-    threads = tf.train.start_queue_runners(coord=coord, sess=sess)
+        raw_output_all = tf.reduce_mean(tf.stack([head_output, tail_output_rev]), axis=0)
+        raw_output_all = tf.expand_dims(raw_output_all, dim=0)
+        pred_scores = tf.reduce_max(raw_output_all, axis=3)
+        raw_output_all = tf.argmax(raw_output_all, axis=3)
+        pred_all = tf.expand_dims(raw_output_all, dim=3) # Create 4-d tensor.
 
-    try:
-        # Run inference
-        parsing_, scores, edge_ = sess.run([pred_all, pred_scores, pred_edge])
-        
-        # Get filename without path and extension
-        img_id = os.path.basename(args.input).split('.')[0]
-        
-        # Create visualization
-        msk = decode_labels(parsing_, num_classes=N_CLASSES)
-        parsing_im = Image.fromarray(msk[0])
-        
-        # Save outputs
-        parsing_vis_path = os.path.join(parsing_dir, f'{img_id}_vis.png')
-        parsing_path = os.path.join(parsing_dir, f'{img_id}.png')
-        edge_path = os.path.join(edge_dir, f'{img_id}.png')
-        
-        parsing_im.save(parsing_vis_path)
-        cv2.imwrite(parsing_path, parsing_[0,:,:,0])
-        cv2.imwrite(edge_path, edge_[0,:,:,0] * 255)
-        
-        # Copy the main segmentation output to the specified output path
-        cv2.imwrite(args.output, parsing_[0,:,:,0])
-        
-        print(f"Saved segmentation to {args.output}")
-        print(f"Saved visualization to {parsing_vis_path}")
-        print(f"Saved edge map to {edge_path}")
-        
-        return 0
-    
-    except Exception as e:
-        print(f"Error during processing: {e}")
-        import traceback
-        traceback.print_exc()
+        raw_edge = tf.reduce_mean(tf.stack([edge_out2]), axis=0)
+        head_output, tail_output = tf.unstack(raw_edge, num=2, axis=0)
+        tail_output_rev = tf.reverse(tail_output, tf.stack([1]))
+        raw_edge_all = tf.reduce_mean(tf.stack([head_output, tail_output_rev]), axis=0)
+        raw_edge_all = tf.expand_dims(raw_edge_all, dim=0)
+        pred_edge = tf.sigmoid(raw_edge_all)
+        res_edge = tf.cast(tf.greater(pred_edge, 0.5), tf.int32)
+
+        self.pred_all = pred_all
+        self.pred_scores = pred_scores
+        self.pred_edge = pred_edge
+
+        # Which variables to load.
+        restore_var = tf.global_variables()
+
+        # Set up tf session and initialize variables.
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        self.sess = tf.Session(config=config)
+        init = tf.global_variables_initializer()
+
+        self.sess.run(init)
+        self.sess.run(tf.local_variables_initializer())
+
+        # Load weights.
+        loader = tf.compat.v1.train.Saver(var_list=restore_var)
+        if RESTORE_FROM is not None:
+            if load(loader, self.sess, RESTORE_FROM):
+                print(" [*] Load SUCCESS")
+            else:
+                print(" [!] Load failed...")
+
+    def run(self, input_path, output_path, npy_input=None, npy_output=None):
+        """Parse one image and write the label map to output_path"""
+        # Make sure output directory exists
+        output_dir = os.path.dirname(output_path)
+        parsing_dir = os.path.join(output_dir, 'cihp_parsing_maps')
+        edge_dir = os.path.join(output_dir, 'cihp_edge_maps')
+
+        os.makedirs(output_dir, exist_ok=True)
+        os.makedirs(parsing_dir, exist_ok=True)
+        os.makedirs(edge_dir, exist_ok=True)
+
+        try:
+            # Run inference, from the decoded array when one was handed over
+            if npy_input and os.path.exists(npy_input):
+                rgb = np.load(npy_input, mmap_mode='r')
+                feed_dict = {self.image: rgb[:, :, ::-1].astype(np.float32) - READER_IMG_MEAN}
+            else:
+                feed_dict = {self.image_path: input_path}
+            parsing_, scores, edge_ = self.sess.run(
+                [self.pred_all, self.pred_scores, self.pred_edge],
+                feed_dict=feed_dict)
+
+            # Get filename without path and extension
+            img_id = os.path.basename(input_path).split('.')[0]
+
+            # Create visualization
+            msk = decode_labels(parsing_, num_classes=self.N_CLASSES)
+            parsing_im = Image.fromarray(msk[0])
+
+            # Save outputs
+            parsing_vis_path = os.path.join(parsing_dir, f'{img_id}_vis.png')
+            parsing_path = os.path.join(parsing_dir, f'{img_id}.png')
+            edge_path = os.path.join(edge_dir, f'{img_id}.png')
+
+            parsing_im.save(parsing_vis_path)
+            cv2.imwrite(parsing_path, parsing_[0,:,:,0])
+            cv2.imwrite(edge_path, edge_[0,:,:,0] * 255)
+
+            # Copy the main segmentation output to the specified output path
+            cv2.imwrite(output_path, parsing_[0,:,:,0])
+            if npy_output:
+                np.save(npy_output, parsing_[0,:,:,0].astype(np.uint8))
+
+            print(f"Saved segmentation to {output_path}")
+            print(f"Saved visualization to {parsing_vis_path}")
+            print(f"Saved edge map to {edge_path}")
+
+            return 0
+
+        except Exception as e:
+            print(f"Error during processing: {e}")
+            import traceback
+            traceback.print_exc()
+            return 1
+
+    def close(self):
+        self.sess.close()
+        print("Finished processing")
+
+def run_args(model, args):
+    """Validate the CLI arguments and parse the requested image"""
+    # Validate input file exists
+    if not os.path.exists(args.input):
+        print(f"Error: Input image '{args.input}' does not exist!")
         return 1
-    
+
+    if ensure_val_files(args):
+        return 1
+
+    return model.run(args.input, args.output, args.npy_input, args.npy_output)
+
+def build_worker():
+    """Restore the PGN checkpoint once and return a handler for model_worker.py"""
+    models = {}
+
+    def handle(argv):
+        args = parse_args(argv)
+        if args.checkpoint not in models:
+            # Each checkpoint gets its own graph so variable scopes don't clash
+            with tf.Graph().as_default():
+                models[args.checkpoint] = PGNInference(args.checkpoint)
+        return run_args(models[args.checkpoint], args)
+
+    return handle
+
+def main():
+    """Create the model and start the evaluation process."""
+    args = parse_args()
+
+    # Validate input file exists
+    if not os.path.exists(args.input):
+        print(f"Error: Input image '{args.input}' does not exist!")
+        return 1
+
+    model = PGNInference(args.checkpoint)
+    try:
+        return run_args(model, args)
     finally:
-        coord.request_stop()
-        coord.join(threads)
-        sess.close()
-        print("Finished processing")
+        model.close()
 
 if __name__ == '__main__':
     sys.exit(main())
\ No newline at end of file